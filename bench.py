@@ -0,0 +1,164 @@
+#Alexandra Zana 40131077
+#Brandon Tsitsirides 40176018
+
+# Search benchmark of wargame2 on fixed positions from real games: runs suggest_move at a fixed depth
+# and at a fixed time, and compares throughput with a stored baseline.
+# usage: python bench.py --depth 4 --time 0.5 [--save bench_baseline.json] [--baseline bench_baseline.json]
+
+from __future__ import annotations
+import argparse
+import dataclasses
+import json
+import os
+import re
+from time import perf_counter
+from typing import Tuple
+from wargame2 import Game, Options
+
+# trace line of a played move, in the old ("Attacker made move D3 C3.") and current ("action: ...") formats
+MOVE_LINE = re.compile(r'made move|^action: ')
+# board row of a trace, ex: "B: dT9  .  dP9  .   .  "
+BOARD_LINE = re.compile(r'^([A-Z]): (.*)$')
+
+def positions_from_trace(path: str, every: int = 1) -> list[Tuple[str, str]]:
+    """(name, position string) of every board printed in a game trace file, the turn being the number of moves before it."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    if path.endswith('.jsonl'):
+        # JSON lines trace of wargame2's TraceWriter: the start and turn records have the position
+        with open(path) as trace:
+            records = [json.loads(line) for line in trace if line.strip()]
+        positions = [(f"{name}@{record.get('turn', 0)}", record['position']) for record in records if 'position' in record]
+        return positions[::every]
+    positions = []
+    turns = 0
+    rows = []
+    with open(path) as trace:
+        for line in trace:
+            match = BOARD_LINE.match(line.rstrip('\n'))
+            if match:
+                rows.append(",".join(match.group(2).split()))
+                continue
+            if rows:
+                player = 'a' if turns % 2 == 0 else 'd'
+                positions.append((f"{name}@{turns}", f"{'/'.join(rows)} {player} {turns}"))
+                rows = []
+            if MOVE_LINE.search(line):
+                turns += 1
+    if rows:
+        player = 'a' if turns % 2 == 0 else 'd'
+        positions.append((f"{name}@{turns}", f"{'/'.join(rows)} {player} {turns}"))
+    return positions[::every]
+
+def run_search(position: str, options: Options) -> dict:
+    """suggest_move on a fresh game of the position; returns its measurements."""
+    game = Game.from_position_string(position, options)
+    start = perf_counter()
+    move = game.suggest_move()
+    elapsed = perf_counter() - start
+    game.close()
+    return {
+        'move': None if move is None else move.to_string(),
+        'score': game.stats.last_score,
+        'depth': game.stats.last_depth,
+        'nodes': game.stats.nodes,
+        'seconds': elapsed,
+        'nps': game.stats.nodes / elapsed if elapsed > 0 else 0.0,
+    }
+
+def run_suite(positions: list[Tuple[str, str]], depth: int, max_time: float, base: Options) -> dict:
+    """Search every position at fixed depth (time to depth) and at fixed time."""
+    results = {'depth': depth, 'time': max_time, 'positions': {}}
+    totals = {'depth_nodes': 0, 'depth_seconds': 0.0, 'time_nodes': 0, 'time_seconds': 0.0}
+    for (name, position) in positions:
+        game = Game.from_position_string(position, base)
+        if game.is_finished():
+            continue
+        fixed_depth = run_search(position, dataclasses.replace(base, min_depth=1, max_depth=depth, max_time=None))
+        fixed_time = run_search(position, dataclasses.replace(base, min_depth=1, max_depth=None, max_time=max_time))
+        results['positions'][name] = {'position': position, 'fixed_depth': fixed_depth, 'fixed_time': fixed_time}
+        totals['depth_nodes'] += fixed_depth['nodes']
+        totals['depth_seconds'] += fixed_depth['seconds']
+        totals['time_nodes'] += fixed_time['nodes']
+        totals['time_seconds'] += fixed_time['seconds']
+        print(f"{name:32} depth {depth}: {fixed_depth['move']} {fixed_depth['score']:0.1f} {fixed_depth['nodes']:8} nodes "
+            f"{fixed_depth['seconds']:6.3f}s {fixed_depth['nps']/1000:6.1f}k/s | {max_time}s: depth {fixed_time['depth']} "
+            f"{fixed_time['nodes']:8} nodes {fixed_time['nps']/1000:6.1f}k/s")
+    totals['depth_nps'] = totals['depth_nodes'] / totals['depth_seconds'] if totals['depth_seconds'] > 0 else 0.0
+    totals['time_nps'] = totals['time_nodes'] / totals['time_seconds'] if totals['time_seconds'] > 0 else 0.0
+    results['totals'] = totals
+    return results
+
+def compare_plain(positions: list[Tuple[str, str]], depth: int, base: Options):
+    """Print the nodes searched to a fixed depth by plain alpha-beta and by the principal variation search."""
+    plain = dataclasses.replace(base, min_depth=1, max_depth=depth, max_time=None, pvs=False, aspiration_window=0)
+    pvs = dataclasses.replace(base, min_depth=1, max_depth=depth, max_time=None)
+    totals = [0, 0]
+    for (name, position) in positions:
+        if Game.from_position_string(position, base).is_finished():
+            continue
+        (plain_search, pvs_search) = (run_search(position, plain), run_search(position, pvs))
+        totals[0] += plain_search['nodes']
+        totals[1] += pvs_search['nodes']
+        print(f"{name:32} alpha-beta {plain_search['nodes']:8} nodes {plain_search['move']} {plain_search['score']:0.1f} | "
+            f"pvs {pvs_search['nodes']:8} nodes {pvs_search['move']} {pvs_search['score']:0.1f}")
+    print(f"total: alpha-beta {totals[0]} nodes, pvs {totals[1]} nodes ({100*(totals[1]/totals[0]-1):+0.1f}%)")
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Print the differences with a baseline; False if throughput dropped by more than tolerance."""
+    ok = True
+    for key in ('depth_nps', 'time_nps'):
+        (now, then) = (results['totals'][key], baseline['totals'][key])
+        change = now / then - 1 if then > 0 else 0.0
+        status = "ok"
+        if change < -tolerance:
+            status = "REGRESSION"
+            ok = False
+        print(f"{key}: {now/1000:0.1f}k/s vs {then/1000:0.1f}k/s baseline ({100*change:+0.1f}%) {status}")
+    if results['depth'] == baseline.get('depth'):
+        # node counts and best moves at fixed depth are deterministic: list what changed
+        for (name, entry) in results['positions'].items():
+            old = baseline['positions'].get(name)
+            if old is None:
+                continue
+            (new_search, old_search) = (entry['fixed_depth'], old['fixed_depth'])
+            if new_search['nodes'] != old_search['nodes'] or new_search['move'] != old_search['move']:
+                print(f"{name}: {old_search['move']} {old_search['nodes']} nodes -> {new_search['move']} {new_search['nodes']} nodes")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='bench',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--traces', type=str, nargs='*', default=["gameTrace-false-10.0-25.txt"], help='game trace files to take positions from')
+    parser.add_argument('--every', type=int, default=3, help='take every n-th board of each trace')
+    parser.add_argument('--depth', type=int, default=4, help='fixed search depth')
+    parser.add_argument('--time', type=float, default=0.5, help='fixed search time')
+    parser.add_argument('--baseline', type=str, default="bench_baseline.json", help='baseline to compare with (if it exists)')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed throughput drop (fraction)')
+    parser.add_argument('--save', type=str, help='save the results as a new baseline')
+    parser.add_argument('--compare_plain', action='store_true', help='only compare node counts of pvs and plain alpha-beta at fixed depth')
+    args = parser.parse_args()
+
+    base = Options(max_turns=100, verbose=False)
+    positions = [("start", Game(options=base).to_position_string())]
+    for path in args.traces:
+        positions += positions_from_trace(path, args.every)
+    if args.compare_plain:
+        compare_plain(positions, args.depth, base)
+        return
+    results = run_suite(positions, args.depth, args.time, base)
+    print(f"total: depth {args.depth} {results['totals']['depth_nps']/1000:0.1f}k nodes/s, "
+        f"{args.time}s {results['totals']['time_nps']/1000:0.1f}k nodes/s")
+
+    ok = True
+    if os.path.exists(args.baseline) and args.baseline != args.save:
+        with open(args.baseline) as baseline_file:
+            ok = compare(results, json.load(baseline_file), args.tolerance)
+    if args.save is not None:
+        with open(args.save, 'w') as out_file:
+            json.dump(results, out_file, indent=1)
+    if not ok:
+        exit(1)
+
+if __name__ == '__main__':
+    main()
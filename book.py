@@ -0,0 +1,75 @@
+#Alexandra Zana 40131077
+#Brandon Tsitsirides 40176018
+
+# Opening book builder of wargame2: searches every position of the first plies of the game deeply
+# and writes the best moves to a book file keyed by position hash, for Options.book (--book).
+# usage: python book.py --plies 4 --depth 6 --output opening_book.bin
+
+from __future__ import annotations
+import argparse
+from time import perf_counter
+from typing import Tuple
+from wargame2 import Game, Options, OpeningBook, TranspositionTable
+
+def build_book(plies: int, options: Options) -> dict[int, Tuple[int, int, float, int]]:
+    """Best move of every position reached in fewer than plies moves (by either side) from the initial board.
+
+    Returns position hash -> (move src, move dst, score, depth), as written by OpeningBook.write.
+    """
+    dim = options.dim
+    root = Game(options=options)
+    # one table shared by the searches of every position (clones keep the reference)
+    if options.tt_size_mb > 0:
+        root._tt = TranspositionTable(options.tt_size_mb)
+    entries = {}
+    frontier = [root]
+    for ply in range(plies):
+        start = perf_counter()
+        searched = 0
+        next_frontier = []
+        for game in frontier:
+            if game._hash in entries or game.is_finished():
+                continue
+            move = game.suggest_move()
+            if move is None:
+                continue
+            entries[game._hash] = (move.src.row*dim+move.src.col, move.dst.row*dim+move.dst.col,
+                game.stats.last_score, game.stats.last_depth)
+            searched += 1
+            for candidate in list(game.move_candidates()):
+                child = game.clone()
+                child.perform_move(candidate)
+                child.next_turn()
+                next_frontier.append(child)
+        frontier = next_frontier
+        print(f"ply {ply}: {searched} positions in {perf_counter()-start:0.1f}s")
+    return entries
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='book',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--plies', type=int, default=3, help='plies from the initial board covered by the book')
+    parser.add_argument('--depth', type=int, default=6, help='search depth of each position')
+    parser.add_argument('--max_time', type=float, help='maximum search time of each position')
+    parser.add_argument('--dim', type=int, default=5, help='board size')
+    parser.add_argument('--max_turns', type=int, default=100, help='maximum turns of the games the book is for')
+    parser.add_argument('--output', type=str, default="opening_book.bin", help='book file')
+    args = parser.parse_args()
+
+    options = Options(dim=args.dim, min_depth=1, max_depth=args.depth, max_time=args.max_time,
+        max_turns=args.max_turns, verbose=False, collect_stats=False)
+    entries = build_book(args.plies, options)
+    OpeningBook.write(args.output, args.dim, entries)
+    print(f"{len(entries)} positions written to {args.output}")
+
+    # check the book answers every position it was built from
+    book = OpeningBook(args.output)
+    missing = sum(1 for key in entries if book.probe(key) is None)
+    book.close()
+    if missing > 0:
+        print(f"{missing} positions missing from the book")
+        exit(1)
+
+if __name__ == '__main__':
+    main()
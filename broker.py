@@ -0,0 +1,271 @@
+#Alexandra Zana 40131077
+#Brandon Tsitsirides 40176018
+
+# Game broker client of wargame2: one keep-alive HTTP session (pooled connections) per game, exponential
+# backoff with jitter while waiting for the opponent's move, and latency/retry metrics. Also has a local
+# stand-in broker; running this file plays moves between two clients through it and prints the metrics.
+# usage: python broker.py --moves 200 [--fail_rate 0.05]
+
+from __future__ import annotations
+import argparse
+import json
+import random
+import socket
+import threading
+from array import array
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, perf_counter
+import requests
+from requests.adapters import HTTPAdapter
+
+def percentile(values: array | list[float], fraction: float) -> float:
+    """Value below which a fraction of the values fall (nearest rank), 0 if there are none."""
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered)-1, max(0, int(fraction*len(ordered) + 0.5) - 1))]
+
+@dataclass(slots=True)
+class Backoff:
+    """Exponential backoff with full jitter: each delay is random in [0, min(max_delay, base*2^attempt)]."""
+    base : float = 0.05
+    max_delay : float = 2.0
+    attempt : int = 0
+    rng : random.Random = field(default_factory=random.Random, repr=False)
+
+    def next_delay(self) -> float:
+        """Delay before the next try, longer after each one."""
+        delay = min(self.max_delay, self.base * (1 << min(self.attempt, 30)))
+        self.attempt += 1
+        return self.rng.uniform(0, delay)
+
+    def reset(self):
+        """Start again from the base delay (after a success)."""
+        self.attempt = 0
+
+@dataclass(slots=True)
+class BrokerMetrics:
+    """Counters and request latencies of a broker client."""
+    requests : int = 0
+    errors : int = 0
+    retries : int = 0
+    polls : int = 0
+    empty_polls : int = 0
+    moves_sent : int = 0
+    moves_received : int = 0
+    # seconds of each request, and spent waiting for each move received
+    latencies : array = field(default_factory=lambda: array('d'))
+    waits : array = field(default_factory=lambda: array('d'))
+
+    def to_dict(self) -> dict:
+        """Counters and latency percentiles (ms), for JSON export."""
+        data = {name: getattr(self, name) for name in ('requests', 'errors', 'retries', 'polls', 'empty_polls', 'moves_sent', 'moves_received')}
+        data['latency_p50_ms'] = 1000*percentile(self.latencies, 0.5)
+        data['latency_p99_ms'] = 1000*percentile(self.latencies, 0.99)
+        data['latency_max_ms'] = 1000*max(self.latencies, default=0.0)
+        data['wait_p50_ms'] = 1000*percentile(self.waits, 0.5)
+        return data
+
+    def summary(self) -> str:
+        """One line summary."""
+        data = self.to_dict()
+        return (f"{data['requests']} requests ({data['errors']} errors, {data['retries']} retries), "
+            f"{data['polls']} polls ({data['empty_polls']} empty), latency p50 {data['latency_p50_ms']:0.1f}ms "
+            f"p99 {data['latency_p99_ms']:0.1f}ms")
+
+class BrokerError(Exception):
+    """The broker could not be reached or answered with an error, after all retries."""
+
+class BrokerClient:
+    """Client of a game broker: posts moves and waits for the opponent's moves over one pooled keep-alive session.
+
+    Move data is the broker's JSON: {"from": {"row", "col"}, "to": {"row", "col"}, "turn"}, in answers of
+    the form {"success": bool, "data": ...}.
+    """
+
+    def __init__(self, url: str, pool_size: int = 4, timeout: float = 5.0, retries: int = 3,
+            poll_base: float = 0.05, poll_max_delay: float = 2.0):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Accept': 'application/json'})
+        self.poll_backoff = Backoff(poll_base, poll_max_delay)
+        self.metrics = BrokerMetrics()
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+
+    def request(self, method: str, json_data: dict | None = None) -> dict:
+        """Send a request, retrying failed connections and server errors with backoff; returns the answer's JSON."""
+        backoff = Backoff(self.poll_backoff.base, self.poll_backoff.max_delay)
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                self.metrics.retries += 1
+                sleep(backoff.next_delay())
+            self.metrics.requests += 1
+            start = perf_counter()
+            try:
+                r = self.session.request(method, self.url, json=json_data, timeout=self.timeout)
+                self.metrics.latencies.append(perf_counter() - start)
+                if r.status_code >= 500 or r.status_code == 429:
+                    self.metrics.errors += 1
+                    error = f"status code: {r.status_code}"
+                    continue
+                if r.status_code != 200:
+                    # client errors are not retried (and their body need not be JSON)
+                    self.metrics.errors += 1
+                    raise BrokerError(f"status code: {r.status_code}, response: {r.text[:200]}")
+                answer = r.json()
+                if not answer.get('success'):
+                    self.metrics.errors += 1
+                    raise BrokerError(f"status code: {r.status_code}, response: {answer}")
+                return answer
+            except (requests.ConnectionError, requests.Timeout, ValueError) as exception:
+                self.metrics.errors += 1
+                error = str(exception)
+        raise BrokerError(f"no answer after {self.retries + 1} tries: {error}")
+
+    def post_move(self, data: dict):
+        """Send a move; the broker must echo it back."""
+        answer = self.request('POST', data)
+        if answer.get('data') != data:
+            raise BrokerError(f"move not accepted, response: {answer}")
+        self.metrics.moves_sent += 1
+
+    def poll_move(self, turn: int) -> dict | None:
+        """Ask once for the move of a turn (None if it is not there yet)."""
+        self.metrics.polls += 1
+        data = self.request('GET').get('data')
+        if data is None or data.get('turn') != turn:
+            self.metrics.empty_polls += 1
+            return None
+        return data
+
+    def wait_for_move(self, turn: int, timeout: float | None = None) -> dict | None:
+        """Poll until the move of a turn arrives, backing off (with jitter) while it does not; None on timeout.
+
+        Broker errors count as empty polls, the wait goes on.
+        """
+        start = perf_counter()
+        self.poll_backoff.reset()
+        while True:
+            try:
+                data = self.poll_move(turn)
+            except BrokerError as error:
+                print(f"Broker error: {error}")
+                data = None
+            if data is not None:
+                self.metrics.moves_received += 1
+                self.metrics.waits.append(perf_counter() - start)
+                return data
+            delay = self.poll_backoff.next_delay()
+            if timeout is not None and perf_counter() - start + delay > timeout:
+                return None
+            sleep(delay)
+
+class StandInBroker:
+    """Local broker for tests: keeps the last move posted and serves it, on 127.0.0.1 in a thread.
+
+    A fraction fail_rate of the requests (at random) gets a 503 answer, to exercise retries.
+    """
+
+    def __init__(self, fail_rate: float = 0.0, seed: int = 472):
+        broker = self
+        self.move = None
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # headers and body go out in separate writes: do not let the body wait for an ACK
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, format, *args):
+                pass
+
+            def answer(self, status: int, body: dict):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                with broker.lock:
+                    (fail, move) = (broker.rng.random() < broker.fail_rate, broker.move)
+                if fail:
+                    self.answer(503, {'success': False, 'error': 'unavailable'})
+                else:
+                    self.answer(200, {'success': True, 'data': move})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                with broker.lock:
+                    fail = broker.rng.random() < broker.fail_rate
+                    if not fail:
+                        broker.move = body
+                if fail:
+                    self.answer(503, {'success': False, 'error': 'unavailable'})
+                else:
+                    self.answer(200, {'success': True, 'data': body})
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='broker',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--moves', type=int, default=200, help='moves to play between the two clients')
+    parser.add_argument('--fail_rate', type=float, default=0.0, help='fraction of stand-in broker requests that fail')
+    parser.add_argument('--think', type=float, default=0.01, help='seconds each client takes to play')
+    args = parser.parse_args()
+
+    broker = StandInBroker(args.fail_rate)
+    clients = [BrokerClient(broker.url), BrokerClient(broker.url)]
+
+    def play(side: int):
+        # side 1 plays the odd turns, side 0 the even ones; each waits for the other's move then answers
+        client = clients[side]
+        for turn in range(1, args.moves+1):
+            if turn % 2 == 1 - side:
+                if client.wait_for_move(turn, timeout=30.0) is None:
+                    raise BrokerError(f"no move for turn {turn}")
+            else:
+                sleep(args.think)
+                client.post_move({'from': {'row': 0, 'col': 0}, 'to': {'row': 0, 'col': 1}, 'turn': turn})
+
+    start = perf_counter()
+    threads = [threading.Thread(target=play, args=(side,)) for side in (0, 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+    for (side, client) in enumerate(clients):
+        print(f"client {side}: {client.metrics.summary()}")
+        client.close()
+    print(f"{args.moves} moves in {elapsed:0.2f}s")
+    broker.close()
+
+if __name__ == '__main__':
+    main()
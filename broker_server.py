@@ -0,0 +1,245 @@
+#Alexandra Zana 40131077
+#Brandon Tsitsirides 40176018
+
+# Local asyncio game broker for load tests: serves many game channels (one per URL path) with the broker
+# protocol of wargame2 (GET the last move, POST a move; answers {"success": ..., "data": ...}) over
+# keep-alive HTTP/1.1, and a load generator that plays many games between engine clients through it
+# and reports move round-trip latency and throughput.
+# usage: python broker_server.py --games 100 --turns 40       (load test against a server in the same process)
+#        python broker_server.py --serve --port 8001          (server only, ex: for wargame2.py --broker http://127.0.0.1:8001/game1)
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import random
+from array import array
+from time import perf_counter
+from typing import Tuple
+from urllib.parse import urlsplit
+from broker import Backoff, percentile
+from wargame2 import Game, Options, Player, CoordPair, Coord
+
+# seconds a load client waits for the opponent's move before giving up on the game
+WAIT_TIMEOUT = 30.0
+
+class BrokerServer:
+    """Broker hosting any number of game channels, each keeping the last move posted to its path."""
+
+    def __init__(self):
+        self.channels : dict[str, dict] = {}
+        self.requests = 0
+        self.connections = 0
+        self.server : asyncio.Server | None = None
+
+    async def start(self, host: str, port: int) -> int:
+        """Start listening; returns the port (useful with port 0)."""
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """Stop listening."""
+        self.server.close()
+        await self.server.wait_closed()
+
+    def answer(self, method: str, path: str, body: bytes) -> Tuple[int, dict]:
+        """Status and JSON answer of a request to a channel."""
+        if method == 'GET':
+            return (200, {'success': True, 'data': self.channels.get(path)})
+        if method == 'POST':
+            try:
+                move = json.loads(body)
+            except ValueError:
+                return (400, {'success': False, 'error': 'invalid JSON'})
+            self.channels[path] = move
+            return (200, {'success': True, 'data': move})
+        return (405, {'success': False, 'error': f"method {method} not allowed"})
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve the requests of one connection until the client closes it."""
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                (method, target, version) = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    (name, _, value) = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                self.requests += 1
+                (status, answer) = self.answer(method, urlsplit(target).path, body)
+                data = json.dumps(answer).encode()
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                # headers and body in a single write
+                writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+class LoadClient:
+    """Keep-alive HTTP connection of one engine client of the load generator."""
+
+    def __init__(self, host: str, port: int):
+        (self.host, self.port) = (host, port)
+        self.reader : asyncio.StreamReader | None = None
+        self.writer : asyncio.StreamWriter | None = None
+        self.requests = 0
+
+    async def request(self, method: str, path: str, data: dict | None = None) -> dict:
+        """Send a request and read the JSON answer (connecting first if needed)."""
+        if self.writer is None:
+            (self.reader, self.writer) = await asyncio.open_connection(self.host, self.port)
+        body = b'' if data is None else json.dumps(data).encode()
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nAccept: application/json\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+        await self.writer.drain()
+        self.requests += 1
+        await self.reader.readline()
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            (name, _, value) = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        return json.loads(await self.reader.readexactly(length))
+
+    async def close(self):
+        """Close the connection."""
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+async def wait_for_move(client: LoadClient, channel: str, turn: int, backoff: Backoff, timeout: float | None) -> dict | None:
+    """Poll a channel until the move of a turn arrives, backing off while it does not; None on timeout."""
+    backoff.reset()
+    start = perf_counter()
+    while True:
+        data = (await client.request('GET', channel))['data']
+        if data is not None and data['turn'] == turn:
+            return data
+        if timeout is not None and perf_counter() - start > timeout:
+            return None
+        await asyncio.sleep(backoff.next_delay())
+
+async def play_client(client: LoadClient, channel: str, side: Player, turns: int, seed: int,
+        poll_base: float, poll_max_delay: float, round_trips: array) -> int:
+    """Play one side of a game through the broker with random legal moves; returns the moves played.
+
+    The round trip of a move is the time from posting it to receiving the opponent's reply.
+    """
+    rng = random.Random(seed)
+    game = Game(options=Options(max_turns=turns, verbose=False))
+    backoff = Backoff(poll_base, poll_max_delay, rng=rng)
+    played = 0
+    sent = None
+    while not game.is_finished():
+        if game.next_player == side:
+            moves = list(game.move_candidates())
+            if len(moves) == 0:
+                break
+            move = rng.choice(moves)
+            game.perform_move(move)
+            game.next_turn()
+            data = {"from": {"row": move.src.row, "col": move.src.col}, "to": {"row": move.dst.row, "col": move.dst.col}, "turn": game.turns_played}
+            sent = perf_counter()
+            answer = await client.request('POST', channel, data)
+            if not answer['success'] or answer['data'] != data:
+                raise RuntimeError(f"broker did not accept move: {answer}")
+            played += 1
+            continue
+        # (an opponent without moves never sends one)
+        data = await wait_for_move(client, channel, game.turns_played+1, backoff, WAIT_TIMEOUT)
+        if data is None:
+            return played
+        if sent is not None:
+            round_trips.append(perf_counter() - sent)
+        move = CoordPair(Coord(data['from']['row'], data['from']['col']), Coord(data['to']['row'], data['to']['col']))
+        if not game.perform_move(move)[0]:
+            raise RuntimeError(f"invalid move from broker on {channel}: {move}")
+        game.next_turn()
+    return played
+
+async def load_test(args) -> dict:
+    """Play args.games games (two clients each) at once through a broker; returns the measurements."""
+    server = None
+    (host, port) = (args.host, args.port)
+    if args.url is None:
+        server = BrokerServer()
+        port = await server.start(host, 0)
+    else:
+        split = urlsplit(args.url)
+        (host, port) = (split.hostname, split.port or 80)
+    round_trips = array('d')
+    clients = [LoadClient(host, port) for _ in range(2*args.games)]
+    start = perf_counter()
+    tasks = []
+    for game in range(args.games):
+        for side in (Player.Attacker, Player.Defender):
+            client = clients[2*game + side.value]
+            tasks.append(play_client(client, f"/game{game}", side, args.turns, args.seed + 2*game + side.value,
+                args.poll_base, args.poll_max_delay, round_trips))
+    moves = sum(await asyncio.gather(*tasks))
+    elapsed = perf_counter() - start
+    for client in clients:
+        await client.close()
+    requests = sum(client.requests for client in clients)
+    if server is not None:
+        await server.close()
+    return {'games': args.games, 'clients': len(clients), 'moves': moves, 'requests': requests, 'seconds': elapsed,
+        'moves_per_second': moves / elapsed, 'requests_per_second': requests / elapsed,
+        'round_trip_p50_ms': 1000*percentile(round_trips, 0.5), 'round_trip_p99_ms': 1000*percentile(round_trips, 0.99)}
+
+async def serve(host: str, port: int):
+    """Run a broker until interrupted."""
+    server = BrokerServer()
+    port = await server.start(host, port)
+    print(f"broker listening on http://{host}:{port}/<channel>")
+    async with server.server:
+        await server.server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='broker_server',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--serve', action='store_true', help='only run the broker')
+    parser.add_argument('--host', type=str, default="127.0.0.1", help='broker address')
+    parser.add_argument('--port', type=int, default=8001, help='broker port (with --serve)')
+    parser.add_argument('--url', type=str, help='load test an already running broker instead of one in this process')
+    parser.add_argument('--games', type=int, default=100, help='concurrent games (two engine clients each)')
+    parser.add_argument('--turns', type=int, default=40, help='maximum turns of each game')
+    parser.add_argument('--poll_base', type=float, default=0.005, help='first delay between polls while waiting for a move')
+    parser.add_argument('--poll_max_delay', type=float, default=0.2, help='longest delay between polls')
+    parser.add_argument('--seed', type=int, default=472, help='seed of the random moves')
+    parser.add_argument('--json', action='store_true', help='print the measurements as JSON')
+    args = parser.parse_args()
+
+    if args.serve:
+        try:
+            asyncio.run(serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return
+    results = asyncio.run(load_test(args))
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print(f"{results['games']} games, {results['clients']} clients: {results['moves']} moves in {results['seconds']:0.2f}s, "
+            f"{results['moves_per_second']:0.1f} moves/s, {results['requests_per_second']:0.1f} requests/s, "
+            f"round trip p50 {results['round_trip_p50_ms']:0.1f}ms p99 {results['round_trip_p99_ms']:0.1f}ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#Alexandra Zana 40131077
+#Brandon Tsitsirides 40176018
+
+# Multi-game host of wargame2: runs many independent games on one asyncio event loop, each with its own
+# options, and sends their searches to a bounded pool of worker processes. At most --max_searches searches
+# run at once, and turns wait for a search slot in the order they came (one pending search per game), so
+# no game starves. Games play themselves, or play one side against an opponent through a broker.
+# Each worker process keeps its search tables between searches: one transposition table and move orderer per
+# set of game options (shared by the games using them), and its opening book and tablebase files opened once.
+# usage: python game_host.py --games 20 --processes 4 --config "max_time=0.2" "max_depth=3,max_time=None"
+#        python game_host.py --games 50 --broker "http://127.0.0.1:8001/game{game}" --side defender
+
+from __future__ import annotations
+import argparse
+import asyncio
+import dataclasses
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import Tuple
+from urllib.parse import urlsplit
+from broker import Backoff, percentile
+from broker_server import LoadClient, wait_for_move
+from tournament import parse_config
+from wargame2 import Game, Options, Player, CoordPair, Coord, SearchStats, TranspositionTable, MoveOrderer, OpeningBook, Tablebase
+
+# seconds past its max_time a side playing through the broker may take to move before it loses
+MOVE_SLACK = 10.0
+
+# search tables of a worker process by game options (repr), and its opening books and tablebases by path
+_worker_tables : dict[str, Tuple[TranspositionTable | None, MoveOrderer | None]] = {}
+_worker_books : dict[str, OpeningBook] = {}
+_worker_tablebases : dict[Tuple[str, int], Tablebase] = {}
+
+def host_search(game: Game) -> Tuple[CoordPair | None, float, int, int, float, SearchStats | None]:
+    """suggest_move in a worker process: (move, score, depth, nodes, seconds, search statistics).
+
+    The game (a search_copy) comes without search tables: it gets this process's tables for its options,
+    so that a search reuses the entries and move history of the earlier searches of games with the same
+    options instead of allocating and filling a new table every turn.
+    """
+    # the pool is the parallelism: no nested worker processes, pondering or printing in a worker
+    options = game.options = dataclasses.replace(game.options, workers=1, ponder=False, verbose=False)
+    key = repr(options)
+    tables = _worker_tables.get(key)
+    if tables is None:
+        tables = _worker_tables[key] = (TranspositionTable(options.tt_size_mb) if options.tt_size_mb > 0 else None,
+            MoveOrderer(options.dim) if options.move_ordering else None)
+    (game._tt, game._orderer) = tables
+    if options.book is not None:
+        if options.book not in _worker_books:
+            _worker_books[options.book] = OpeningBook(options.book)
+        game._book = _worker_books[options.book]
+    if options.tablebase is not None:
+        if (options.tablebase, options.dim) not in _worker_tablebases:
+            _worker_tablebases[(options.tablebase, options.dim)] = Tablebase(options.tablebase, options.dim)
+        game._tablebase = _worker_tablebases[(options.tablebase, options.dim)]
+    move = game.suggest_move()
+    search = game.stats.moves[-1] if game.stats.moves else None
+    return (move, game.stats.last_score, game.stats.last_depth, game.stats.nodes, game.stats.total_seconds, search)
+
+class GameHost:
+    """Searches of many games on one event loop, run by a bounded process pool."""
+
+    def __init__(self, processes: int, max_searches: int):
+        self.pool = ProcessPoolExecutor(max_workers=processes)
+        # asyncio semaphores wake their waiters first come, first served
+        self.slots = asyncio.Semaphore(max_searches)
+        self.running = 0
+        self.most_running = 0
+        # seconds each turn waited for a search slot
+        self.queue_waits = array('d')
+
+    def close(self):
+        """Shut down the worker processes."""
+        self.pool.shutdown(cancel_futures=True)
+
+    async def search(self, game: Game) -> CoordPair | None:
+        """Search a game's position in the pool and add the search to the game's statistics."""
+        queued = perf_counter()
+        async with self.slots:
+            self.queue_waits.append(perf_counter() - queued)
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+            try:
+                (move, score, depth, nodes, seconds, search) = await asyncio.get_running_loop().run_in_executor(
+                    self.pool, host_search, game.search_copy())
+            finally:
+                self.running -= 1
+        stats = game.stats
+        stats.nodes += nodes
+        stats.total_seconds += seconds
+        (stats.last_score, stats.last_depth) = (score, depth)
+        if search is not None:
+            stats.add_search(search)
+        return move
+
+async def run_game(host: GameHost, number: int, options: Options, broker: str | None, engine: Tuple[Player, ...],
+        move_slack: float = MOVE_SLACK) -> dict:
+    """Play one hosted game to the end; the engine plays the sides in engine, the broker the others.
+
+    A broker side that does not move within max_time + move_slack seconds loses.
+    """
+    game = Game(options=options)
+    client = None
+    if broker is not None:
+        url = urlsplit(broker.format(game=number))
+        (client, channel) = (LoadClient(url.hostname, url.port or 80), url.path or '/')
+        backoff = Backoff()
+    winner = None
+    while (winner := game.has_winner()) is None:
+        player = game.next_player
+        if player in engine:
+            move = await host.search(game)
+            if move is None or not game.perform_move(move)[0]:
+                # a side without a (valid) move loses
+                winner = player.next()
+                break
+            game.next_turn()
+            if client is not None:
+                data = {"from": {"row": move.src.row, "col": move.src.col}, "to": {"row": move.dst.row, "col": move.dst.col}, "turn": game.turns_played}
+                await client.request('POST', channel, data)
+        else:
+            data = await wait_for_move(client, channel, game.turns_played+1, backoff, (options.max_time or 0.0) + move_slack)
+            if data is None:
+                print(f"game {number}: no move from broker for {player.name}")
+                winner = player.next()
+                break
+            move = CoordPair(Coord(data['from']['row'], data['from']['col']), Coord(data['to']['row'], data['to']['col']))
+            if not game.perform_move(move)[0]:
+                print(f"game {number}: invalid move from broker: {move}")
+                winner = player.next()
+                break
+            game.next_turn()
+    if client is not None:
+        await client.close()
+    return {'game': number, 'winner': winner.name, 'turns': game.turns_played, 'searches': len(game.stats.moves),
+        'nodes': game.stats.nodes, 'search_seconds': game.stats.total_seconds}
+
+async def host_games(args, configs: list[Options]) -> Tuple[list[dict], GameHost, float]:
+    """Run every game at once; returns their results, the host and the elapsed time."""
+    host = GameHost(args.processes, args.max_searches)
+    if args.broker is None:
+        engine = (Player.Attacker, Player.Defender)
+    else:
+        engine = (Player[args.side.capitalize()],)
+    start = perf_counter()
+    results = await asyncio.gather(*(run_game(host, number, configs[number % len(configs)], args.broker, engine, args.move_slack)
+        for number in range(args.games)))
+    elapsed = perf_counter() - start
+    host.close()
+    return (results, host, elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='game_host',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--games', type=int, default=20, help='games to host at once')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='search worker processes')
+    parser.add_argument('--max_searches', type=int, help='most searches running at once (default: processes)')
+    parser.add_argument('--config', type=str, nargs='*', default=["max_time=0.2"],
+        help='options of the games, used in turn (see tournament.py), ex: max_depth=3,max_time=None')
+    parser.add_argument('--max_turns', type=int, default=100, help='maximum turns per game')
+    parser.add_argument('--broker', type=str, help='broker URL of each game ({game} is its number); without it games play themselves')
+    parser.add_argument('--side', type=str, default="defender", help='side played by the engine against the broker: attacker|defender')
+    parser.add_argument('--move_slack', type=float, default=MOVE_SLACK, help='seconds past max_time the broker side may take to move before it loses')
+    args = parser.parse_args()
+    if args.max_searches is None:
+        args.max_searches = args.processes
+
+    base = Options(max_turns=args.max_turns, verbose=False)
+    try:
+        configs = [parse_config(config, base) for config in args.config or [""]]
+    except ValueError as error:
+        parser.error(str(error))
+    (results, host, elapsed) = asyncio.run(host_games(args, configs))
+
+    searches = [result['searches'] for result in results]
+    print(f"{len(results)} games in {elapsed:0.1f}s: {sum(searches)} searches ({sum(searches)/elapsed:0.1f}/s), "
+        f"{sum(result['nodes'] for result in results)/elapsed/1000:0.1f}k nodes/s, at most {host.most_running} at once")
+    print(f"wait for a search slot: p50 {1000*percentile(host.queue_waits, 0.5):0.1f}ms, "
+        f"p99 {1000*percentile(host.queue_waits, 0.99):0.1f}ms, max {1000*max(host.queue_waits, default=0.0):0.1f}ms")
+    wins = {player.name: sum(1 for result in results if result['winner'] == player.name) for player in Player}
+    print(f"wins: {wins}, searches per game: {min(searches)} to {max(searches)}")
+
+if __name__ == '__main__':
+    main()
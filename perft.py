@@ -0,0 +1,122 @@
+#Alexandra Zana 40131077
+#Brandon Tsitsirides 40176018
+
+# perft: counts the leaf nodes of the move tree of wargame2 positions to a fixed depth, to check
+# that move generation and make/unmake stay correct (and measure their speed) after board changes.
+# usage: python perft.py --depth 4 [--position start] [--divide] [--bench] [--check] [--compact_board]
+
+from __future__ import annotations
+import argparse
+from time import perf_counter
+from wargame2 import Game, Options, CoordPair
+
+# stored positions: name, position string (see Game.to_position_string) and known leaf counts by depth
+POSITIONS = (
+    ("start", "dA9,dT9,dF9,.,./dT9,dP9,.,.,./dF9,.,.,.,aP9/.,.,.,aF9,aV9/.,.,aP9,aV9,aA9 a 0",
+        {1: 6, 2: 36, 3: 240, 4: 1564, 5: 11548}),
+    # from gameTrace-false-10.0-25.txt
+    ("trace-6", "dA9,dT9,dF9,.,./.,dT9,.,dP9,./dF9,.,.,aF9,aP9/.,.,aV9,.,aV9/.,.,aP9,.,aA9 a 6",
+        {1: 8, 2: 73, 3: 666, 4: 5718, 5: 54591}),
+    ("trace-10", ".,dT9,dF9,.,./dA9,.,dT9,dP9,./dF9,aV9,.,aF9,aP9/.,.,.,.,aV9/.,.,aP9,.,aA9 a 10",
+        {1: 10, 2: 86, 3: 920, 4: 8316, 5: 91486}),
+    ("trace-14", ".,dT9,dF9,.,./.,dA9,dT9,dP8,aP9/dF8,aV8,.,aF8,./.,.,.,.,aV9/.,.,aP9,.,aA9 a 14",
+        {1: 11, 2: 83, 3: 961, 4: 8452, 5: 100008}),
+)
+
+def perft(game: Game, depth: int, check: bool = False) -> int:
+    """Number of leaf nodes depth plies below the position (finished games count as leaves).
+
+    With check, also verify the generated moves against is_valid_move and that unmake_move
+    restores the position and its hash.
+    """
+    if depth == 0 or game.is_finished():
+        return 1
+    moves = list(game.move_candidates())
+    if check:
+        check_moves(game, moves)
+        before = (game.to_position_string(), game._hash)
+    nodes = 0
+    for move in moves:
+        game.make_move(move)
+        nodes += perft(game, depth-1, check)
+        game.unmake_move()
+        if check and (game.to_position_string(), game._hash) != before:
+            raise AssertionError(f"unmake of {move} did not restore {before[0]}")
+    return nodes
+
+def check_moves(game: Game, moves: list[CoordPair]):
+    """Compare the generated moves with every src/dst pair accepted by is_valid_move.
+
+    Self-destructs (src == dst) are left out, move_candidates does not generate them.
+    """
+    dim = game.options.dim
+    generated = sorted(move.to_string() for move in moves)
+    legal = []
+    for src in CoordPair.from_dim(dim).iter_rectangle():
+        for dst in CoordPair.from_dim(dim).iter_rectangle():
+            move = CoordPair(src, dst)
+            if src != dst and game.is_valid_move(move):
+                legal.append(move.to_string())
+    if generated != sorted(legal):
+        raise AssertionError(f"move_candidates {generated} differ from is_valid_move {sorted(legal)} in {game.to_position_string()}")
+    if game.compute_hash() != game._hash:
+        raise AssertionError(f"incremental hash differs from compute_hash in {game.to_position_string()}")
+
+def divide(game: Game, depth: int, check: bool = False) -> int:
+    """Print the leaf count below each root move; returns the total."""
+    total = 0
+    for move in list(game.move_candidates()):
+        game.make_move(move)
+        nodes = perft(game, depth-1, check)
+        game.unmake_move()
+        print(f"{move}: {nodes}")
+        total += nodes
+    print(f"total: {total}")
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='perft',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--depth', type=int, default=3, help='depth in plies')
+    parser.add_argument('--position', type=str, default="all", help='stored position name, position string or all')
+    parser.add_argument('--divide', action='store_true', help='list the leaf count of each root move')
+    parser.add_argument('--bench', action='store_true', help='report nodes per second')
+    parser.add_argument('--check', action='store_true', help='check move legality and make/unmake at every node')
+    parser.add_argument('--compact_board', action='store_true', help='store the board in flat byte arrays')
+    args = parser.parse_args()
+
+    options = Options(max_turns=100, compact_board=args.compact_board)
+    if args.position == "all":
+        positions = POSITIONS
+    else:
+        positions = [p for p in POSITIONS if p[0] == args.position] or [("custom", args.position, {})]
+
+    failed = False
+    total_nodes = 0
+    total_seconds = 0.0
+    for (name, position, expected) in positions:
+        game = Game.from_position_string(position, options)
+        print(f"{name} depth {args.depth}:")
+        start = perf_counter()
+        if args.divide:
+            nodes = divide(game, args.depth, args.check)
+        else:
+            nodes = perft(game, args.depth, args.check)
+        elapsed = perf_counter() - start
+        total_nodes += nodes
+        total_seconds += elapsed
+        line = f"  {nodes} nodes"
+        if args.bench:
+            line += f" in {elapsed:0.3f}s, {nodes/elapsed/1000:0.1f}k nodes/s"
+        if args.depth in expected and expected[args.depth] != nodes:
+            line += f" MISMATCH (expected {expected[args.depth]})"
+            failed = True
+        print(line)
+    if args.bench and len(positions) > 1:
+        print(f"total: {total_nodes} nodes in {total_seconds:0.3f}s, {total_nodes/total_seconds/1000:0.1f}k nodes/s")
+    if failed:
+        exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#Alexandra Zana 40131077
+#Brandon Tsitsirides 40176018
+
+# Measures how the parallel searches of wargame2 scale with the number of worker processes:
+# time to reach a depth with iterative deepening, nodes per second and speedup against 1 worker (the serial search).
+# usage: python search_scaling.py --mode smp --depth 5 --workers 1 2 4 8
+
+from __future__ import annotations
+import argparse
+import dataclasses
+import random
+from time import perf_counter
+from typing import Tuple
+from wargame2 import Game, Options, CoordPair, TranspositionTable
+
+def sample_positions(count: int, plies: int, seed: int, options: Options) -> list[Game]:
+    """Positions reached by playing random legal moves from the initial board."""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        game = Game(options=options)
+        for _ in range(plies):
+            moves = list(game.move_candidates())
+            if game.is_finished() or len(moves) == 0:
+                break
+            game.perform_move(rng.choice(moves))
+            game.next_turn()
+        if not game.is_finished():
+            positions.append(game)
+    return positions
+
+def make_runner(options: Options) -> Game:
+    """Game owning the worker processes and transposition table used to search every position."""
+    runner = Game(options=options)
+    if options.workers > 1:
+        runner.root_pool()
+        # start the worker processes before timing anything
+        runner._pool.submit(int).result()
+    if runner._tt is None and options.tt_size_mb > 0:
+        runner._tt = TranspositionTable(options.tt_size_mb)
+    return runner
+
+def timed_search(position: Game, runner: Game) -> Tuple[float, CoordPair | None, float, int]:
+    """Search a position with the options, workers and (cleared) table of runner: (score, move, seconds, nodes)."""
+    search = position.search_copy()
+    search.options = runner.options
+    search._pool = runner._pool
+    search._pool_alpha = runner._pool_alpha
+    search._pool_stop = runner._pool_stop
+    search._tt = runner._tt
+    if search._tt is not None:
+        search._tt.clear()
+    start = perf_counter()
+    (score, move, _) = search.iterative_deepening()
+    return (score, move, perf_counter() - start, search._nodes)
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='search_scaling',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--mode', type=str, default="smp", help='parallel search: root|smp')
+    parser.add_argument('--depth', type=int, default=5, help='depth to reach by iterative deepening')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='worker counts to compare')
+    parser.add_argument('--positions', type=int, default=5, help='number of sample positions')
+    parser.add_argument('--plies', type=int, default=6, help='random plies played to reach each position')
+    parser.add_argument('--seed', type=int, default=472, help='seed of the sample positions')
+    args = parser.parse_args()
+
+    options = Options(min_depth=1, max_depth=args.depth, max_time=None, max_turns=100, lazy_smp=args.mode == "smp")
+    positions = sample_positions(args.positions, args.plies, args.seed, options)
+
+    # 1 worker is the serial search
+    serial = [timed_search(position, make_runner(options)) for position in positions]
+    serial_time = sum(r[2] for r in serial)
+    serial_nps = sum(r[3] for r in serial) / serial_time
+    print(f"{args.mode} search, time to depth {args.depth} over {len(positions)} positions")
+    for workers in args.workers:
+        if workers <= 1:
+            results = serial
+        else:
+            runner = make_runner(dataclasses.replace(options, workers=workers))
+            results = [timed_search(position, runner) for position in positions]
+            runner.close()
+        elapsed = sum(r[2] for r in results)
+        nodes = sum(r[3] for r in results)
+        same = sum(1 for (r, s) in zip(results, serial) if r[1] == s[1])
+        print(f"{workers} workers: {elapsed:0.2f}s, speedup {serial_time/elapsed:0.2f}x, "
+            f"{nodes} nodes, {nodes/elapsed/1000:0.1f}k nodes/s ({nodes/elapsed/serial_nps:0.2f}x), "
+            f"{same}/{len(positions)} moves equal to serial")
+
+if __name__ == '__main__':
+    main()
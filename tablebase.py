@@ -0,0 +1,317 @@
+#Alexandra Zana 40131077
+#Brandon Tsitsirides 40176018
+
+# Endgame tablebase generator of wargame2: solves every position with up to --units units (the two AIs
+# included), for every health value and side to move, by retrograde analysis, and writes one table per
+# material signature for Options.tablebase (--tablebase). Tables hold the plies each side needs to force
+# its win without a turn limit; the turns remaining are applied when probing (see Tablebase.probe).
+# Every table of n units has 2*(dim*dim*9)^n positions: 3 units on a 5x5 board is 23M positions per table.
+# usage: python tablebase.py --units 3 --dim 4 --output tablebase [--check 200]
+
+from __future__ import annotations
+import argparse
+import itertools
+import os
+import random
+from array import array
+from time import perf_counter
+from typing import Tuple, Iterable
+from wargame2 import Game, Options, Player, UnitType, Unit, NeighbourTables, Tablebase, CoordPair, SELFDESTRUCT_DAMAGE
+
+INFINITE = Tablebase.INFINITE
+# unit types that cannot move while engaged in combat, and only move towards the other side
+RESTRICTED = (UnitType.AI.value, UnitType.Firewall.value, UnitType.Program.value)
+
+def signatures(units: int) -> list[list[Tuple[int, int]]]:
+    """(player value, type value) of each unit of every signature with both AIs and at most units units, smallest first.
+
+    There are at most as many units of a kind as on the initial board.
+    """
+    counts = {}
+    for player in Player:
+        for (_, unit) in Game(options=Options()).player_units(player):
+            if unit.type != UnitType.AI:
+                kind = (player.value, unit.type.value)
+                counts[kind] = counts.get(kind, 0) + 1
+    result = []
+    for extra in range(units-1):
+        for combination in itertools.combinations_with_replacement(sorted(counts), extra):
+            if all(combination.count(kind) <= counts[kind] for kind in combination):
+                result.append(sorted([(Player.Attacker.value, UnitType.AI.value), (Player.Defender.value, UnitType.AI.value)] + list(combination)))
+    return result
+
+def successors(units: list[Tuple[int, int, int, int]], player: int, dim: int) -> list[list[Tuple[int, int, int, int]]]:
+    """Units (player, type, cell index, health) after every legal action of player, dead units removed.
+
+    Same rules as Game.is_valid_move and Game.apply_move, self-destructs included.
+    """
+    tables = NeighbourTables.for_dim(dim)
+    (damage_table, repair_table) = (Unit.damage_table, Unit.repair_table)
+    occupant = {unit[2]: i for (i, unit) in enumerate(units)}
+    result = []
+    for (i, (owner, unit_type, cell, health)) in enumerate(units):
+        if owner != player:
+            continue
+        engaged = any(units[occupant[c]][0] != player for c in tables.adjacent[cell] if c in occupant)
+        for target_cell in tables.adjacent[cell]:
+            after = list(units)
+            j = occupant.get(target_cell)
+            if j is None:
+                if unit_type in RESTRICTED:
+                    if engaged:
+                        continue
+                    (row, col, target_row, target_col) = (cell // dim, cell % dim, target_cell // dim, target_cell % dim)
+                    if (target_row > row or target_col > col) if player == Player.Attacker.value else (target_row < row or target_col < col):
+                        continue
+                after[i] = (owner, unit_type, target_cell, health)
+            else:
+                (target_owner, target_type, _, target_health) = units[j]
+                if target_owner == player:
+                    if target_health == 9:
+                        continue
+                    after[j] = (target_owner, target_type, target_cell, min(9, target_health + repair_table[unit_type][target_type]))
+                else:
+                    damage = min(damage_table[unit_type][target_type], target_health)
+                    after[i] = (owner, unit_type, cell, max(0, health - damage))
+                    after[j] = (target_owner, target_type, target_cell, target_health - damage)
+            result.append(after)
+        if health < 9:
+            after = list(units)
+            after[i] = (owner, unit_type, cell, 0)
+            for around in tables.around[cell]:
+                j = occupant.get(around)
+                if j is not None:
+                    (target_owner, target_type, _, target_health) = after[j]
+                    after[j] = (target_owner, target_type, around, max(0, target_health - SELFDESTRUCT_DAMAGE))
+            result.append(after)
+    return [sorted(unit for unit in after if unit[3] > 0) for after in result]
+
+def name_of(signature: list[Tuple[int, int]]) -> str:
+    """Name of a signature, ex: aAaV-dA (see Tablebase.signature)."""
+    return Tablebase.signature([kind + (0, 0) for kind in signature])
+
+def outcome(after: list[Tuple[int, int, int, int]], player: int, dim: int, solved: dict[str, bytearray]) -> Tuple[int, int]:
+    """(attacker, defender) plies to force a win from a position left by a move of player that killed units:
+    0 if it ended the game, else looked up in the table of the smaller signature."""
+    ais = [unit[0] for unit in after if unit[1] == UnitType.AI.value]
+    if Player.Attacker.value not in ais:
+        return (INFINITE, 0)
+    if Player.Defender.value not in ais:
+        return (0, INFINITE)
+    data = solved[Tablebase.signature(after)]
+    offset = 2*Tablebase.index(after, 1-player, dim)
+    return (data[offset], data[offset+1])
+
+def positions(signature: list[Tuple[int, int]], dim: int) -> Iterable[list[Tuple[int, int, int, int]]]:
+    """Units of every position of a signature (identical units sorted by cell)."""
+    same = [i > 0 and signature[i] == signature[i-1] for i in range(len(signature))]
+    for cells in itertools.permutations(range(dim*dim), len(signature)):
+        if any(same[i] and cells[i] < cells[i-1] for i in range(len(cells))):
+            continue
+        for healths in itertools.product(range(1, 10), repeat=len(signature)):
+            yield [(player, unit_type, cell, health) for ((player, unit_type), cell, health) in zip(signature, cells, healths)]
+
+def solve(signature: list[Tuple[int, int]], dim: int, solved: dict[str, bytearray]) -> bytearray:
+    """Table of a signature: (attacker, defender) plies to force a win for every position index.
+
+    Moves that kill units lead to the smaller signatures, which must be in solved already.
+    """
+    size = (dim*dim*9)**len(signature)
+    count = 2*size
+    # internal moves (between positions of this signature) and, for each goal player, the best result of
+    # the moves leaving it: least plies if the goal player moves, else most plies (INFINITE if one escapes)
+    (sources, targets) = (array('I'), array('I'))
+    internal = array('i', bytes(4*count))
+    exits = (bytearray([INFINITE])*size + bytearray(size), bytearray(size) + bytearray([INFINITE])*size)
+    valid = array('I')
+    for units in positions(signature, dim):
+        for player in (Player.Attacker.value, Player.Defender.value):
+            index = Tablebase.index(units, player, dim)
+            valid.append(index)
+            for after in successors(units, player, dim):
+                result = outcome(after, player, dim, solved) if len(after) < len(units) else None
+                if result is None:
+                    sources.append(index)
+                    targets.append(Tablebase.index(after, 1-player, dim))
+                    internal[index] += 1
+                    continue
+                for goal in (0, 1):
+                    plies = result[goal] + 1 if result[goal] + 1 < INFINITE else INFINITE
+                    if player == goal:
+                        exits[goal][index] = min(exits[goal][index], plies)
+                    elif exits[goal][index] != INFINITE:
+                        exits[goal][index] = max(exits[goal][index], plies)
+    # predecessors of each position (the internal moves sorted by target)
+    offsets = array('I', bytes(4*(count+1)))
+    for target in targets:
+        offsets[target+1] += 1
+    for index in range(count):
+        offsets[index+1] += offsets[index]
+    fill = array('I', offsets)
+    predecessors = array('I', bytes(4*len(targets)))
+    for (source, target) in zip(sources, targets):
+        predecessors[fill[target]] = source
+        fill[target] += 1
+    del sources, targets, fill
+
+    data = bytearray(2*count)
+    for goal in (0, 1):
+        data[goal::2] = retrograde(goal, size, valid, internal, exits[goal], offsets, predecessors)
+    return data
+
+def retrograde(goal: int, size: int, valid: array, internal: array, exits: bytearray, offsets: array, predecessors: array) -> bytearray:
+    """Plies in which goal can force a win from every position (INFINITE if it cannot), by increasing distance.
+
+    A position of goal is solved by its fastest solved successor, a position of the other player once
+    all its successors are solved, by the slowest.
+    """
+    plies = bytearray([INFINITE])*(2*size)
+    pending = array('i', internal)
+    slowest = bytearray(exits)
+    buckets = [[] for _ in range(INFINITE)]
+    for index in valid:
+        exit = exits[index]
+        if (index >= size) == (goal == 1):
+            if exit != INFINITE:
+                buckets[exit].append(index)
+        elif exit != INFINITE and internal[index] == 0:
+            buckets[exit].append(index)
+    for distance in range(INFINITE):
+        for index in buckets[distance]:
+            if plies[index] != INFINITE:
+                continue
+            plies[index] = distance
+            if distance + 1 >= INFINITE:
+                continue
+            for k in range(offsets[index], offsets[index+1]):
+                previous = predecessors[k]
+                if plies[previous] != INFINITE:
+                    continue
+                if (previous >= size) == (goal == 1):
+                    buckets[distance+1].append(previous)
+                elif slowest[previous] != INFINITE:
+                    pending[previous] -= 1
+                    slowest[previous] = max(slowest[previous], distance+1)
+                    if pending[previous] == 0:
+                        buckets[slowest[previous]].append(previous)
+        buckets[distance] = None
+    return plies
+
+def write_table(path: str, signature: list[Tuple[int, int]], dim: int, data: bytearray):
+    """Write a table file (see Tablebase)."""
+    with open(path, 'wb') as table_file:
+        table_file.write(Tablebase.HEADER.pack(Tablebase.MAGIC, dim, len(signature)))
+        table_file.write(bytes(value for kind in signature for value in kind))
+        table_file.write(data)
+
+def game_of(units: list[Tuple[int, int, int, int]], player: int, dim: int, options: Options | None = None) -> Game:
+    """Game with only the given units on the board (no turn limit unless options say otherwise)."""
+    rows = [['.']*dim for _ in range(dim)]
+    for (owner, unit_type, cell, health) in units:
+        rows[cell // dim][cell % dim] = Player(owner).name[0].lower() + UnitType(unit_type).name[0] + str(health)
+    position = "/".join(",".join(row) for row in rows) + " " + Player(player).name[0].lower() + " 0"
+    return Game.from_position_string(position, options or Options(dim=dim, max_turns=None, verbose=False))
+
+def units_of(game: Game) -> list[Tuple[int, int, int, int]]:
+    """Sorted units (player, type, cell index, health) of a game."""
+    dim = game.options.dim
+    return sorted((unit.player.value, unit.type.value, coord.row*dim+coord.col, unit.health)
+        for player in Player for (coord, unit) in game.player_units(player))
+
+def check(signature: list[Tuple[int, int]], dim: int, solved: dict[str, bytearray], samples: int, rng: random.Random):
+    """Check successors against Game moves, and the solved plies of random positions against their successors."""
+    data = solved[name_of(signature)]
+    for _ in range(samples):
+        cells = rng.sample(range(dim*dim), len(signature))
+        units = sorted((player, unit_type, cell, rng.randint(1, 9)) for ((player, unit_type), cell) in zip(signature, cells))
+        player = rng.randint(0, 1)
+        game = game_of(units, player, dim)
+        expected = []
+        for src in CoordPair.from_dim(dim).iter_rectangle():
+            for dst in CoordPair.from_dim(dim).iter_rectangle():
+                after = game.clone()
+                if after.perform_move(CoordPair(src, dst))[0]:
+                    after.next_turn()
+                    expected.append(units_of(after))
+        generated = successors(units, player, dim)
+        if sorted(generated) != sorted(expected):
+            raise AssertionError(f"successors differ from Game moves in {game.to_position_string()}")
+        offset = 2*Tablebase.index(units, player, dim)
+        for goal in (0, 1):
+            results = []
+            for after in generated:
+                result = outcome(after, player, dim, solved) if len(after) < len(units) else None
+                if result is None:
+                    other = 2*Tablebase.index(after, 1-player, dim)
+                    result = (data[other], data[other+1])
+                results.append(INFINITE if result[goal] == INFINITE else result[goal] + 1)
+            if player == goal:
+                plies = min(results, default=INFINITE)
+            else:
+                plies = max(results, default=0)
+            if plies >= INFINITE:
+                plies = INFINITE
+            if data[offset+goal] != plies:
+                raise AssertionError(f"{Player(goal).name} plies {data[offset+goal]} instead of {plies} in {game.to_position_string()}")
+
+def check_search(signature: list[Tuple[int, int]], dim: int, directory: str, samples: int, rng: random.Random) -> int:
+    """Check that searches with the tables take a win in one move over a longer solved win.
+
+    Returns the number of random positions with such a win that were searched.
+    """
+    options = Options(dim=dim, max_depth=4, max_time=None, max_turns=None, verbose=False, collect_stats=False,
+        tablebase=directory)
+    checked = 0
+    for _ in range(samples):
+        cells = rng.sample(range(dim*dim), len(signature))
+        units = sorted((player, unit_type, cell, rng.randint(1, 9)) for ((player, unit_type), cell) in zip(signature, cells))
+        player = Player(rng.randint(0, 1))
+        game = game_of(units, player.value, dim, options)
+        wins = []
+        for move in game.move_candidates():
+            after = game.clone()
+            after.perform_move(move)
+            after.next_turn()
+            if after.has_winner() == player:
+                wins.append(move.to_string())
+        if len(wins) == 0:
+            continue
+        move = game.suggest_move()
+        if move is None or move.to_string() not in wins:
+            raise AssertionError(f"search played {move} instead of a win in one ({', '.join(wins)}) in {game.to_position_string()}")
+        game.close()
+        checked += 1
+    return checked
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='tablebase',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--units', type=int, default=3, help='most units on the board (the two AIs included)')
+    parser.add_argument('--dim', type=int, default=5, help='board size')
+    parser.add_argument('--output', type=str, default="tablebase", help='directory of the table files')
+    parser.add_argument('--check', type=int, default=0, help='random positions of each table to check against the Game rules')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    rng = random.Random(472)
+    solved = {}
+    for signature in signatures(args.units):
+        name = name_of(signature)
+        start = perf_counter()
+        data = solve(signature, args.dim, solved)
+        solved[name] = data
+        path = os.path.join(args.output, f"tb{args.dim}-{name}.bin")
+        write_table(path, signature, args.dim, data)
+        wins = (sum(1 for plies in data[0::2] if plies != INFINITE), sum(1 for plies in data[1::2] if plies != INFINITE))
+        print(f"{name}: {perf_counter()-start:0.1f}s, attacker wins {wins[0]}, defender wins {wins[1]} "
+            f"(longest {max((p for p in data if p != INFINITE), default=0)} plies), {path}")
+        if args.check > 0:
+            check(signature, args.dim, solved, args.check, rng)
+    if args.check > 0:
+        # with every table written, searches probing them must still prefer ending the game now
+        wins = sum(check_search(signature, args.dim, args.output, args.check, rng) for signature in signatures(args.units))
+        print(f"check ok ({wins} wins in one move found by the search)")
+
+if __name__ == '__main__':
+    main()
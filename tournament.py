@@ -0,0 +1,162 @@
+#Alexandra Zana 40131077
+#Brandon Tsitsirides 40176018
+
+# Headless engine against engine tournament: plays many computer vs computer games of wargame2
+# across worker processes and saves the results in a compact columnar file.
+# usage: python tournament.py --games 1000 --a "max_depth=3" --b "max_depth=3,eval_mode=classic,w1=-2"
+
+from __future__ import annotations
+import argparse
+import dataclasses
+import json
+import os
+import random
+import typing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+from typing import Tuple
+from wargame2 import Game, Options, EvalWeights, Player, OpeningBook
+
+# columns of the results file: name and array typecode
+COLUMNS = (
+    ('game', 'I'),         # game number
+    ('a_side', 'B'),       # side played by config a (Player.value: 0 attacker, 1 defender)
+    ('winner', 'B'),       # winning side (Player.value)
+    ('turns', 'H'),        # turns played
+    ('a_nodes', 'Q'),      # nodes searched by config a
+    ('b_nodes', 'Q'),      # nodes searched by config b
+    ('a_seconds', 'f'),    # search time of config a
+    ('b_seconds', 'f'),    # search time of config b
+)
+
+def parse_value(kind, value: str):
+    """Value of a config item converted to the type of its field (none for optional fields)."""
+    kinds = typing.get_args(kind) or (kind,)
+    if value.lower() == 'none' and type(None) in kinds:
+        return None
+    kind = next(kind for kind in kinds if kind is not type(None))
+    if kind is bool:
+        return value.lower() in ('1', 'true', 'yes')
+    if isinstance(kind, type) and issubclass(kind, Enum):
+        return kind[value] if value in kind.__members__ else kind[value.capitalize()]
+    return kind(value)
+
+def parse_config(text: str, base: Options) -> Options:
+    """Options of one side from comma separated key=value pairs over the base options.
+
+    Keys are Options fields, plus the EvalWeights fields (w0, w1, w2 and scale) for the evaluation weights.
+    Raises ValueError for an unknown key or a book file that cannot be opened.
+    """
+    options = dataclasses.replace(base, eval_weights=dataclasses.replace(base.eval_weights))
+    option_types = typing.get_type_hints(Options)
+    del option_types['eval_weights']
+    weight_types = typing.get_type_hints(EvalWeights)
+    for item in filter(None, (item.strip() for item in text.split(','))):
+        (key, value) = (part.strip() for part in item.split('=', 1))
+        if key in weight_types:
+            setattr(options.eval_weights, key, parse_value(weight_types[key], value))
+        elif key in option_types:
+            setattr(options, key, parse_value(option_types[key], value))
+        else:
+            raise ValueError(f"unknown option in side config: {key}")
+    if options.book is not None:
+        try:
+            OpeningBook.check(options.book)
+        except (OSError, ValueError) as error:
+            raise ValueError(f"book of side config: {error}")
+    return options
+
+def play_game(number: int, a: Options, b: Options, a_side: Player, random_plies: int, seed: int) -> Tuple:
+    """Play one game between configs a and b; returns a row of the results file.
+
+    Each side keeps its own Game (and so its own search tables), the moves being played on both.
+    """
+    rng = random.Random(seed + number)
+    b_side = a_side.next()
+    games = [None, None]
+    games[a_side.value] = Game(options=a)
+    games[b_side.value] = Game(options=b)
+    (game_a, game_b) = (games[a_side.value], games[b_side.value])
+    # a few random opening plies so that games between deterministic engines differ
+    for _ in range(random_plies):
+        moves = list(game_a.move_candidates())
+        if game_a.is_finished() or len(moves) == 0:
+            break
+        move = rng.choice(moves)
+        for game in games:
+            game.perform_move(move)
+            game.next_turn()
+    winner = game_a.has_winner()
+    while winner is None:
+        player = game_a.next_player
+        move = games[player.value].suggest_move()
+        if move is None or not all(game.perform_move(move)[0] for game in games):
+            # a side without a (valid) move loses
+            winner = player.next()
+            break
+        for game in games:
+            game.next_turn()
+        winner = game_a.has_winner()
+    for game in games:
+        game.close()
+    return (number, a_side.value, winner.value, game_a.turns_played,
+        game_a.stats.nodes, game_b.stats.nodes, game_a.stats.total_seconds, game_b.stats.total_seconds)
+
+def play_game_task(args: Tuple) -> Tuple:
+    """play_game with packed arguments, for the process pool."""
+    return play_game(*args)
+
+def write_results(path: str, rows: list[Tuple], header: dict):
+    """Write a JSON header line followed by each column as a packed array."""
+    columns = [array(typecode, (row[i] for row in rows)) for (i, (_, typecode)) in enumerate(COLUMNS)]
+    header = dict(header, rows=len(rows), columns=[[name, typecode] for (name, typecode) in COLUMNS])
+    with open(path, 'wb') as out_file:
+        out_file.write(json.dumps(header).encode() + b'\n')
+        for column in columns:
+            out_file.write(column.tobytes())
+
+def read_results(path: str) -> Tuple[dict, dict[str, array]]:
+    """Read a results file back: (header, column name -> array)."""
+    with open(path, 'rb') as in_file:
+        header = json.loads(in_file.readline())
+        columns = {}
+        for (name, typecode) in header['columns']:
+            column = array(typecode)
+            column.fromfile(in_file, header['rows'])
+            columns[name] = column
+    return (header, columns)
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='tournament',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--games', type=int, default=100, help='number of games')
+    parser.add_argument('--a', type=str, default="", help='options of config a, ex: max_depth=3,eval_mode=classic,w1=-2')
+    parser.add_argument('--b', type=str, default="", help='options of config b')
+    parser.add_argument('--max_turns', type=int, default=100, help='maximum turns per game')
+    parser.add_argument('--random_plies', type=int, default=4, help='random opening plies of each game')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--seed', type=int, default=472, help='seed of the random openings')
+    parser.add_argument('--output', type=str, default="tournament-results.bin", help='results file')
+    args = parser.parse_args()
+
+    base = Options(max_depth=3, min_depth=1, max_time=None, max_turns=args.max_turns, verbose=False)
+    try:
+        a = parse_config(args.a, base)
+        b = parse_config(args.b, base)
+    except ValueError as error:
+        parser.error(str(error))
+    # config a alternates between attacker and defender
+    tasks = [(number, a, b, Player.Attacker if number % 2 == 0 else Player.Defender, args.random_plies, args.seed)
+        for number in range(args.games)]
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        rows = list(pool.map(play_game_task, tasks, chunksize=max(1, len(tasks) // (4 * args.processes))))
+    write_results(args.output, rows, {'a': args.a, 'b': args.b, 'max_turns': args.max_turns,
+        'random_plies': args.random_plies, 'seed': args.seed})
+
+    a_wins = sum(1 for row in rows if row[2] == row[1])
+    print(f"a: {a_wins} wins, b: {len(rows)-a_wins} wins in {len(rows)} games, results in {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -3,19 +3,89 @@
 
 from __future__ import annotations
 import argparse
+import bisect
 import copy
+import json
 from datetime import datetime
 from enum import Enum
-from dataclasses import dataclass, field
-from time import sleep
-from typing import Tuple, TypeVar, Type, Iterable, ClassVar
+from dataclasses import dataclass, field, asdict, replace
+from time import sleep, perf_counter, time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple, TypeVar, Type, Iterable, ClassVar, TYPE_CHECKING
 import random
-#import requests # ?
+import struct
+import mmap
+import os
+import multiprocessing
+import threading
+import queue
+from multiprocessing.shared_memory import SharedMemory
+
+if TYPE_CHECKING:
+    # (imported on first use: the broker client needs the requests package)
+    from broker import BrokerClient
 
 # maximum and minimum values for our heuristic scores (usually represents an end of game condition)
 MAX_HEURISTIC_SCORE = 2000000000
 MIN_HEURISTIC_SCORE = -2000000000
 
+# e0 value of each unit type (AI, Tech, Virus, Program, Firewall)
+UNIT_VALUES = (9999, 3, 3, 3, 3)
+
+# tags for the entries of the make/unmake undo log
+UNDO_MOVE = 0
+UNDO_HEALTH = 1
+UNDO_CELL = 2
+UNDO_AI = 3
+UNDO_TURN = 4
+
+# deepest iteration searched when Options.max_depth is None
+MAX_SEARCH_DEPTH = 100
+
+# records the game trace queues before the game loop waits for its writer thread
+TRACE_QUEUE_SIZE = 4096
+
+# minimax checks the clock once every this many nodes (must be a power of 2)
+DEADLINE_CHECK_INTERVAL = 64
+
+# bound types of transposition table entries
+TT_EXACT = 0
+TT_LOWER = 1
+TT_UPPER = 2
+
+# width of the null windows of the principal variation search (scores are floats, any positive width works)
+NULL_WINDOW = 1e-3
+
+# an aspiration window that failed this many times wider than it started opens fully on that side
+ASPIRATION_MAX_WIDENING = 64
+
+# null-move pruning: depth reduction of the null move search, least depth to try it at, and least
+# units (AI included) the side to move must have (with fewer, passing may be better than any move)
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+NULL_MOVE_MIN_UNITS = 3
+
+# late move reductions: moves searched at full depth first, and least depth to reduce at
+LMR_FULL_MOVES = 3
+LMR_MIN_DEPTH = 3
+
+# damage a self-destruct deals to every unit around it
+SELFDESTRUCT_DAMAGE = 2
+
+# score of a position solved by the endgame tablebase, less the plies to the end of the game (finished
+# games are scored the same way when a tablebase is loaded); scores beyond the bound are such wins or losses
+TABLEBASE_WIN = 1000000000
+TABLEBASE_WIN_BOUND = TABLEBASE_WIN - 100000
+
+# turns left to the turn limit from which transposition table keys include them (searches may reach the limit)
+TURN_LIMIT_HORIZON = 32
+
+# root-parallel workers search just below the shared alpha so that moves tying the best one stay exact
+ROOT_TIE_MARGIN = 1e-6
+
+class SearchTimeout(Exception):
+    """Raised from inside minimax when the search deadline has passed."""
+
 class UnitType(Enum):
     """Every unit type."""
     AI = 0
@@ -42,6 +112,12 @@ class GameType(Enum):
     CompVsDefender = 2
     CompVsComp = 3
 
+class EvalMode(Enum):
+    """How leaves of the search are scored."""
+    Classic = 0
+    Incremental = 1
+    Fused = 2
+
 ##############################################################################################################
 
 @dataclass(slots=True)
@@ -229,6 +305,42 @@ class CoordPair:
 
 ##############################################################################################################
 
+class NeighbourTables:
+    """Precomputed neighbour cell indices (row*dim+col) of every cell, clipped to the board, for one board size."""
+    __slots__ = ('dim', 'coords', 'adjacent', 'around')
+    # one set of tables per board size, shared by every game
+    _cache : ClassVar[dict[int, NeighbourTables]] = {}
+
+    def __init__(self, dim: int):
+        def clipped(coords: Iterable[Coord]) -> tuple[int, ...]:
+            return tuple(c.row*dim+c.col for c in coords if 0 <= c.row < dim and 0 <= c.col < dim)
+        self.dim = dim
+        # shared Coord of every cell index (do not modify them)
+        self.coords = tuple(Coord(index // dim, index % dim) for index in range(dim*dim))
+        # same order as Coord.iter_adjacent and iter_adjacent_and_diagonal (around is iter_range(1) without the cell itself)
+        self.adjacent = tuple(clipped(c.iter_adjacent()) for c in self.coords)
+        self.around = tuple(clipped(c.iter_adjacent_and_diagonal()) for c in self.coords)
+
+    @classmethod
+    def for_dim(cls, dim: int) -> NeighbourTables:
+        """Shared tables for a board size."""
+        tables = cls._cache.get(dim)
+        if tables is None:
+            tables = cls._cache[dim] = NeighbourTables(dim)
+        return tables
+
+##############################################################################################################
+
+@dataclass(slots=True)
+class EvalWeights:
+    """Weights of the combined heuristic: (e0*w0 + e1*w1 + e2*w2) / scale."""
+    w0 : int = 1
+    w1 : int = -1
+    w2 : int = -1
+    scale : int = 3
+
+##############################################################################################################
+
 @dataclass(slots=True)
 class Options:
     """Representation of the game options."""
@@ -242,6 +354,26 @@ class Options:
     randomize_moves : bool = True
     broker : str | None = None
     search_depth : int = 4
+    compact_board : bool = False
+    tt_size_mb : int = 16
+    move_ordering : bool = True
+    eval_mode : EvalMode = EvalMode.Fused
+    eval_weights : EvalWeights = field(default_factory=EvalWeights)
+    eval_parity : bool = False
+    workers : int = 1
+    lazy_smp : bool = False
+    verbose : bool = True
+    collect_stats : bool = True
+    quiescence : bool = True
+    # quiescence nodes allowed per iteration of iterative deepening
+    quiescence_nodes : int = 20000
+    pvs : bool = True
+    aspiration_window : float = 4.0
+    null_move : bool = False
+    lmr : bool = False
+    book : str | None = None
+    tablebase : str | None = None
+    ponder : bool = False
 
 ##############################################################################################################
 
@@ -250,25 +382,726 @@ class Stats:
     """Representation of the global game statistics."""
     evaluations_per_depth : dict[int,int] = field(default_factory=dict)
     total_seconds: float = 0.0
+    nodes : int = 0
+    # score and completed depth of the last suggest_move search
+    last_score : float = 0.0
+    last_depth : int = 0
+    cutoffs : int = 0
+    first_move_cutoffs : int = 0
+    nodes_per_depth : dict[int,int] = field(default_factory=dict)
+    tt_probes : int = 0
+    tt_hits : int = 0
+    quiescence_nodes : int = 0
+    # counters of each search, when Options.collect_stats is on
+    moves : list[SearchStats] = field(default_factory=list)
+
+    def add_search(self, search: SearchStats):
+        """Add the counters of a finished search to the game totals."""
+        add_per_depth(self.nodes_per_depth, search.nodes_per_depth)
+        add_per_depth(self.evaluations_per_depth, search.evaluations_per_depth)
+        self.cutoffs += search.cutoffs
+        self.first_move_cutoffs += search.first_move_cutoffs
+        self.tt_probes += search.tt_probes
+        self.tt_hits += search.tt_hits
+        self.quiescence_nodes += search.quiescence_nodes
+        self.moves.append(search)
+
+    def to_dict(self) -> dict:
+        """Game totals and per move counters, for JSON export."""
+        data = {name: getattr(self, name) for name in ('nodes', 'total_seconds', 'cutoffs', 'first_move_cutoffs',
+            'tt_probes', 'tt_hits', 'quiescence_nodes', 'nodes_per_depth', 'evaluations_per_depth')}
+        data['moves'] = [search.to_dict() for search in self.moves]
+        return data
+
+    def to_json(self) -> str:
+        """Game statistics as JSON."""
+        return json.dumps(self.to_dict())
+
+@dataclass(slots=True)
+class SearchStats:
+    """Counters of one search, depths being plies from the root."""
+    turn : int = 0
+    player : str = ""
+    move : str | None = None
+    score : float = 0.0
+    depth : int = 0
+    seconds : float = 0.0
+    # move answered by the opening book, without a search
+    book : bool = False
+    # move found by the search started while pondering, on a ponder hit
+    ponder : bool = False
+    nodes_per_depth : dict[int,int] = field(default_factory=dict)
+    evaluations_per_depth : dict[int,int] = field(default_factory=dict)
+    cutoffs : int = 0
+    first_move_cutoffs : int = 0
+    tt_probes : int = 0
+    tt_hits : int = 0
+    quiescence_nodes : int = 0
+    # quiescence nodes that stood pat because the iteration's Options.quiescence_nodes budget was spent
+    quiescence_capped : int = 0
+    # re-searches after a null window search failed high, and after an aspiration window failed
+    pvs_researches : int = 0
+    aspiration_researches : int = 0
+    # null move searches and the cutoffs they gave, late move reductions and the re-searches they needed
+    null_move_tries : int = 0
+    null_move_cutoffs : int = 0
+    lmr_reductions : int = 0
+    lmr_researches : int = 0
+    # nodes answered by the endgame tablebase
+    tablebase_hits : int = 0
+    # nodes and seconds of each completed iteration of iterative deepening
+    iteration_nodes : list[int] = field(default_factory=list)
+    iteration_seconds : list[float] = field(default_factory=list)
+
+    def merge(self, other: SearchStats):
+        """Add the counters of a part of this search done elsewhere (ex: by a worker process)."""
+        add_per_depth(self.nodes_per_depth, other.nodes_per_depth)
+        add_per_depth(self.evaluations_per_depth, other.evaluations_per_depth)
+        self.cutoffs += other.cutoffs
+        self.first_move_cutoffs += other.first_move_cutoffs
+        self.tt_probes += other.tt_probes
+        self.tt_hits += other.tt_hits
+        self.quiescence_nodes += other.quiescence_nodes
+        self.quiescence_capped += other.quiescence_capped
+        self.pvs_researches += other.pvs_researches
+        self.null_move_tries += other.null_move_tries
+        self.null_move_cutoffs += other.null_move_cutoffs
+        self.lmr_reductions += other.lmr_reductions
+        self.lmr_researches += other.lmr_researches
+        self.tablebase_hits += other.tablebase_hits
+
+    def branching_factor(self) -> float:
+        """Effective branching factor: growth of the node count between the last two iterations."""
+        if len(self.iteration_nodes) < 2 or self.iteration_nodes[-2] == 0:
+            return 0.0
+        return self.iteration_nodes[-1] / self.iteration_nodes[-2]
+
+    def to_dict(self) -> dict:
+        """Counters and derived rates, for JSON export."""
+        data = asdict(self)
+        data['nodes'] = sum(self.nodes_per_depth.values())
+        data['branching_factor'] = self.branching_factor()
+        data['first_move_cutoff_rate'] = self.first_move_cutoffs / self.cutoffs if self.cutoffs > 0 else 0.0
+        data['tt_hit_rate'] = self.tt_hits / self.tt_probes if self.tt_probes > 0 else 0.0
+        return data
+
+    def to_json(self) -> str:
+        """Search statistics as JSON."""
+        return json.dumps(self.to_dict())
+
+def score_to_tt(score: float, ply: int) -> float:
+    """Score to store in the transposition table: wins and losses counted in plies from the node, not the root."""
+    if TABLEBASE_WIN_BOUND <= score <= TABLEBASE_WIN:
+        return score + ply
+    if -TABLEBASE_WIN <= score <= -TABLEBASE_WIN_BOUND:
+        return score - ply
+    return score
+
+def score_from_tt(score: float, ply: int) -> float:
+    """Score of a transposition table entry seen from a node ply plies from the root (see score_to_tt)."""
+    if TABLEBASE_WIN_BOUND <= score <= TABLEBASE_WIN:
+        return score - ply
+    if -TABLEBASE_WIN <= score <= -TABLEBASE_WIN_BOUND:
+        return score + ply
+    return score
+
+def add_per_depth(total: dict[int,int], counts: dict[int,int]):
+    """Add per depth counts into a total."""
+    for (depth, count) in counts.items():
+        total[depth] = total.get(depth, 0) + count
+
+##############################################################################################################
+
+# lookups from the small ints stored in a CompactBoard back to the enums
+BOARD_OWNERS = (None, Player.Attacker, Player.Defender)
+BOARD_TYPES = tuple(UnitType)
+
+class CompactBoard:
+    """Board stored as flat byte arrays indexed by row*dim+col (owner 0 means the cell is empty)."""
+    __slots__ = ('dim', 'owner', 'type', 'health')
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.owner = bytearray(dim*dim)
+        self.type = bytearray(dim*dim)
+        self.health = bytearray(dim*dim)
+
+    def copy(self) -> CompactBoard:
+        """Copy of the board (plain buffer copies)."""
+        new = CompactBoard.__new__(CompactBoard)
+        new.dim = self.dim
+        new.owner = self.owner[:]
+        new.type = self.type[:]
+        new.health = self.health[:]
+        return new
+
+    def get(self, index: int) -> BoardUnit | None:
+        """View on the unit at a cell index, or None if the cell is empty."""
+        if self.owner[index] == 0:
+            return None
+        return BoardUnit(self, index)
+
+    def set(self, index: int, unit: Unit | BoardUnit | None):
+        """Store a copy of a unit's player, type and health at a cell index."""
+        if unit is None:
+            self.owner[index] = 0
+            self.type[index] = 0
+            self.health[index] = 0
+        else:
+            self.owner[index] = unit.player.value + 1
+            self.type[index] = unit.type.value
+            self.health[index] = unit.health
+
+    def pack(self, index: int) -> int:
+        """Contents of a cell index as a single int (for the undo log)."""
+        return (self.owner[index] << 8) | (self.type[index] << 4) | self.health[index]
+
+    def unpack(self, index: int, packed: int):
+        """Restore the contents of a cell index from pack()."""
+        self.owner[index] = packed >> 8
+        self.type[index] = (packed >> 4) & 0xf
+        self.health[index] = packed & 0xf
+
+class BoardUnit:
+    """Unit-compatible view on an occupied cell of a CompactBoard (writes go to the board arrays)."""
+    __slots__ = ('board', 'index')
+    damage_table = Unit.damage_table
+    repair_table = Unit.repair_table
+    Max_health = 9
+
+    def __init__(self, board: CompactBoard, index: int):
+        self.board = board
+        self.index = index
+
+    @property
+    def player(self) -> Player:
+        return BOARD_OWNERS[self.board.owner[self.index]]
+
+    @property
+    def type(self) -> UnitType:
+        return BOARD_TYPES[self.board.type[self.index]]
+
+    @property
+    def health(self) -> int:
+        return self.board.health[self.index]
+
+    @health.setter
+    def health(self, value: int):
+        self.board.health[self.index] = value
+
+    def mod_health(self, health_delta : int):
+        """Modify this unit's health by delta amount (clamped before it is stored)."""
+        self.health = min(max(self.health + health_delta, 0), 9)
+
+    # same behaviour as the Unit dataclass
+    is_alive = Unit.is_alive
+    to_string = Unit.to_string
+    __str__ = Unit.__str__
+    damage_amount = Unit.damage_amount
+    repair_amount = Unit.repair_amount
+
+##############################################################################################################
+
+class ZobristKeys:
+    """Random 64-bit keys for every (cell, player, unit type, health) plus the side to move, for one board size."""
+    __slots__ = ('dim', 'pieces', 'side', 'perspective', 'turns')
+    # one set of keys per board size, shared by every game (seeded so hashes are the same in every process)
+    _cache : ClassVar[dict[int, ZobristKeys]] = {}
+
+    def __init__(self, dim: int):
+        rng = random.Random(472 + dim)
+        self.dim = dim
+        self.pieces = [rng.getrandbits(64) for _ in range(dim*dim*2*5*10)]
+        self.side = rng.getrandbits(64)
+        self.perspective = (rng.getrandbits(64), rng.getrandbits(64))
+        self.turns = rng.getrandbits(64)
+
+    @classmethod
+    def for_dim(cls, dim: int) -> ZobristKeys:
+        """Shared keys for a board size."""
+        keys = cls._cache.get(dim)
+        if keys is None:
+            keys = cls._cache[dim] = ZobristKeys(dim)
+        return keys
+
+    def piece(self, index: int, player: Player, unit_type: UnitType, health: int) -> int:
+        """Key of a unit with the given health on a cell index."""
+        return self.pieces[((index*2 + player.value)*5 + unit_type.value)*10 + health]
+
+    def turns_left(self, turns: int) -> int:
+        """Key of the number of turns left to the turn limit."""
+        return self.turns ^ ((turns * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF)
+
+class TranspositionTable:
+    """Fixed size hash table of search results, in buckets of a depth-preferred and an always-replace entry."""
+    # key, score, depth, bound type, best move source and destination cell (255 if none)
+    ENTRY : ClassVar[struct.Struct] = struct.Struct('<QdhBBBx')
+    NO_MOVE : ClassVar[int] = 255
+
+    def __init__(self, size_mb: int):
+        self.buckets = max(1, (size_mb * 1024 * 1024) // (2 * self.ENTRY.size))
+        self.data = bytearray(self.buckets * 2 * self.ENTRY.size)
+
+    def clear(self):
+        """Forget every entry."""
+        self.data[:] = bytes(len(self.data))
+
+    def probe(self, key: int) -> Tuple[int, int, float, int, int] | None:
+        """Return (depth, bound type, score, move src, move dst) stored for a key, or None."""
+        size = self.ENTRY.size
+        offset = (key % self.buckets) * 2 * size
+        for slot in (offset, offset + size):
+            (entry_key, score, depth, flag, src, dst) = self.ENTRY.unpack_from(self.data, slot)
+            if entry_key == key:
+                return (depth, flag, score, src, dst)
+        return None
+
+    def store(self, key: int, depth: int, flag: int, score: float, src: int, dst: int):
+        """Store a search result, in the depth-preferred slot if it is at least as deep as what is there."""
+        size = self.ENTRY.size
+        offset = (key % self.buckets) * 2 * size
+        (entry_key, _, entry_depth, _, _, _) = self.ENTRY.unpack_from(self.data, offset)
+        if entry_key != key and entry_depth > depth:
+            offset += size
+        self.ENTRY.pack_into(self.data, offset, key, score, depth, flag, src, dst)
+
+class SharedTranspositionTable(TranspositionTable):
+    """Transposition table in shared memory, used by the Lazy SMP searchers of several processes.
+
+    There are no locks: each entry stores its key xor a checksum of the rest of the entry, so an
+    entry torn by two processes writing it at once reads as a miss instead of a wrong result.
+    """
+    MASK : ClassVar[int] = (1 << 64) - 1
+
+    def __init__(self, size_mb: int, name: str | None = None):
+        """Create a new table, or attach to the table of another process by its shared memory name."""
+        self.buckets = max(1, (size_mb * 1024 * 1024) // (2 * self.ENTRY.size))
+        if name is None:
+            self.shm = SharedMemory(create=True, size=self.buckets * 2 * self.ENTRY.size)
+        else:
+            self.shm = SharedMemory(name=name)
+        self.data = self.shm.buf
+
+    def close(self, unlink: bool):
+        """Detach from the shared memory (and free it if unlink)."""
+        self.data = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+    def probe(self, key: int) -> Tuple[int, int, float, int, int] | None:
+        """Return (depth, bound type, score, move src, move dst) stored for a key, or None."""
+        size = self.ENTRY.size
+        offset = (key % self.buckets) * 2 * size
+        for slot in (offset, offset + size):
+            (check, score, depth, flag, src, dst) = self.ENTRY.unpack_from(self.data, slot)
+            if check ^ (hash((score, depth, flag, src, dst)) & self.MASK) == key:
+                return (depth, flag, score, src, dst)
+        return None
+
+    def store(self, key: int, depth: int, flag: int, score: float, src: int, dst: int):
+        """Store a search result, in the depth-preferred slot if it is at least as deep as what is there."""
+        size = self.ENTRY.size
+        offset = (key % self.buckets) * 2 * size
+        (check, entry_score, entry_depth, entry_flag, entry_src, entry_dst) = self.ENTRY.unpack_from(self.data, offset)
+        entry_key = check ^ (hash((entry_score, entry_depth, entry_flag, entry_src, entry_dst)) & self.MASK)
+        if entry_key != key and entry_depth > depth:
+            offset += size
+        check = key ^ (hash((score, depth, flag, src, dst)) & self.MASK)
+        self.ENTRY.pack_into(self.data, offset, check, score, depth, flag, src, dst)
+
+class OpeningBook:
+    """Moves searched offline (see book.py), read from a file mapped with mmap instead of being loaded.
+
+    The file is a header followed by fixed size entries sorted by position hash, so a probe is a
+    binary search touching a few pages of the file.
+    """
+    # magic, board size, number of entries
+    HEADER : ClassVar[struct.Struct] = struct.Struct('<8sBxxxI')
+    # position hash (Game._hash), move source and destination cell, search depth, score
+    ENTRY : ClassVar[struct.Struct] = struct.Struct('<QBBhf')
+    MAGIC : ClassVar[bytes] = b'WGBOOK1\0'
+
+    def __init__(self, path: str):
+        """Map a book file; raises OSError if it cannot be read, ValueError if it is not a (whole) book."""
+        with open(path, 'rb') as book_file:
+            if os.fstat(book_file.fileno()).st_size < self.HEADER.size:
+                raise ValueError(f"{path} is not an opening book")
+            self.data = mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.dim, self.count) = self.HEADER.unpack_from(self.data, 0)
+        if magic != self.MAGIC or len(self.data) != self.HEADER.size + self.count * self.ENTRY.size:
+            self.data.close()
+            raise ValueError(f"{path} is not an opening book")
+
+    @classmethod
+    def check(cls, path: str):
+        """Check that a book file can be opened (before a game, rather than on its first computer turn)."""
+        cls(path).close()
+
+    def close(self):
+        """Unmap the file."""
+        self.data.close()
+
+    def probe(self, key: int) -> Tuple[int, int, float, int] | None:
+        """Return (move src, move dst, score, depth) stored for a position hash, or None."""
+        (low, high) = (0, self.count)
+        while low < high:
+            middle = (low + high) // 2
+            (entry_key, src, dst, depth, score) = self.ENTRY.unpack_from(self.data, self.HEADER.size + middle * self.ENTRY.size)
+            if entry_key == key:
+                return (src, dst, score, depth)
+            if entry_key < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    @classmethod
+    def write(cls, path: str, dim: int, entries: dict[int, Tuple[int, int, float, int]]):
+        """Write a book of position hash -> (move src, move dst, score, depth)."""
+        with open(path, 'wb') as book_file:
+            book_file.write(cls.HEADER.pack(cls.MAGIC, dim, len(entries)))
+            for key in sorted(entries):
+                (src, dst, score, depth) = entries[key]
+                book_file.write(cls.ENTRY.pack(key, src, dst, depth, score))
+
+class Tablebase:
+    """Endgame tables written by tablebase.py, read from files mapped with mmap.
+
+    There is one file per board size and material signature (the units on the board, ex: aAaV-dA).
+    For every position index it holds two bytes: the plies in which the attacker can force a win, and
+    the plies in which the defender can force the death of the attacker's AI, both without a turn
+    limit (INFINITE if it cannot). The exact result with the turns remaining follows from them.
+    """
+    # magic, board size, number of units (followed by the player and type of each unit of the signature)
+    HEADER : ClassVar[struct.Struct] = struct.Struct('<8sBB')
+    MAGIC : ClassVar[bytes] = b'WGTB1\0\0\0'
+    INFINITE : ClassVar[int] = 255
+
+    def __init__(self, directory: str, dim: int):
+        self.directory = directory
+        self.dim = dim
+        # signature -> mapped file (None if there is no table for it), opened on first use
+        self.tables : dict[str, mmap.mmap | None] = {}
+        prefix = f"tb{dim}-"
+        self.max_units = 0
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name.endswith('.bin'):
+                self.max_units = max(self.max_units, len(name[len(prefix):-4].replace('-', '')) // 2)
+
+    def __getstate__(self):
+        # mapped files are not sent to worker processes, they map the files again
+        return (self.directory, self.dim, self.max_units)
+
+    def __setstate__(self, state):
+        (self.directory, self.dim, self.max_units) = state
+        self.tables = {}
+
+    def close(self):
+        """Unmap every file."""
+        for data in self.tables.values():
+            if data is not None:
+                data.close()
+        self.tables = {}
+
+    @staticmethod
+    def signature(units: list[Tuple[int, int, int, int]]) -> str:
+        """Material signature of units sorted as (player value, type value, cell index, health), ex: aAaV-dA."""
+        codes = ([], [])
+        for (player, unit_type, _, _) in units:
+            codes[player].append(Player(player).name[0].lower() + UnitType(unit_type).name[0])
+        return "".join(codes[0]) + "-" + "".join(codes[1])
+
+    @staticmethod
+    def index(units: list[Tuple[int, int, int, int]], player: int, dim: int) -> int:
+        """Position index of sorted units (see signature) with player to move, in the table of their signature."""
+        size = dim*dim*9
+        index = player
+        for (_, _, cell, health) in units:
+            index = index*size + cell*9 + health-1
+        return index
+
+    def path(self, signature: str) -> str:
+        """File of a signature's table."""
+        return os.path.join(self.directory, f"tb{self.dim}-{signature}.bin")
+
+    def table(self, signature: str) -> mmap.mmap | None:
+        """Mapped file of a signature's table (None if there is none)."""
+        if signature not in self.tables:
+            data = None
+            if os.path.exists(self.path(signature)):
+                with open(self.path(signature), 'rb') as table_file:
+                    data = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+                (magic, dim, count) = self.HEADER.unpack_from(data, 0)
+                if magic != self.MAGIC or dim != self.dim or len(data) != self.HEADER.size + 2*count + 4*(dim*dim*9)**count:
+                    data.close()
+                    raise ValueError(f"{self.path(signature)} is not a tablebase file for dim {self.dim}")
+            self.tables[signature] = data
+        return self.tables[signature]
+
+    def probe(self, game: Game) -> Tuple[Player, int] | None:
+        """Winner of the game and plies to its end with best play, or None if the position is not in the tables.
+
+        The attacker wins if it can force a win before the turn limit; otherwise the defender wins, by
+        killing the attacker's AI if it can force that in time, or else at the turn limit.
+        """
+        units = []
+        for pieces in game._pieces:
+            for index in pieces:
+                unit = game.get_index(index)
+                units.append((unit.player.value, unit.type.value, index, unit.health))
+        if len(units) > self.max_units:
+            return None
+        units.sort()
+        data = self.table(self.signature(units))
+        if data is None:
+            return None
+        offset = self.HEADER.size + 2*len(units) + 2*self.index(units, game.next_player.value, self.dim)
+        (attacker, defender) = (data[offset], data[offset+1])
+        max_turns = game.options.max_turns
+        if max_turns is None:
+            if attacker != self.INFINITE:
+                return (Player.Attacker, attacker)
+            if defender != self.INFINITE:
+                return (Player.Defender, defender)
+            return None
+        remaining = max_turns - game.turns_played
+        if attacker < remaining:
+            return (Player.Attacker, attacker)
+        return (Player.Defender, min(defender, remaining))
+
+class MoveOrderer:
+    """Sorts move candidates so alpha-beta cuts off early.
+
+    Order: the previous iteration's best move (from the transposition table or the last root result),
+    killer moves of the ply, attacks by damage_table value against the target, then the history table.
+    Attacks go after the killers because every attack also costs the attacker the same health.
+    """
+    # score bands (each band is above any score of the band below it)
+    PV : ClassVar[int] = 1 << 60
+    KILLER : ClassVar[int] = 1 << 50
+    ATTACK : ClassVar[int] = 1 << 40
+    KILLERS_PER_PLY : ClassVar[int] = 2
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.cells = dim*dim
+        # killer moves per ply and history scores, both as src*cells+dst move indices
+        self.killers : dict[int, list[int]] = {}
+        self.history = [0] * (self.cells*self.cells)
+        self.root_move = -1
+
+    def new_search(self):
+        """Forget the killers and age the history before searching a new position."""
+        self.killers.clear()
+        self.history = [score >> 1 for score in self.history]
+        self.root_move = -1
+
+    def move_index(self, move: CoordPair) -> int:
+        """Index of a move in the history table."""
+        return (move.src.row*self.dim+move.src.col)*self.cells + move.dst.row*self.dim+move.dst.col
+
+    def order(self, game: Game, moves: list[CoordPair], ply: int, pv_move: int) -> list[CoordPair]:
+        """Return the moves sorted best first (stable, so ties keep generation order)."""
+        killers = self.killers.get(ply, ())
+        history = self.history
+        damage_table = Unit.damage_table
+        player = game.next_player
+        scored = []
+        for move in moves:
+            index = self.move_index(move)
+            if index == pv_move:
+                score = self.PV
+            else:
+                target = game.get(move.dst)
+                if target is not None and target.player != player:
+                    score = self.ATTACK + damage_table[game.get(move.src).type.value][target.type.value]
+                elif index in killers:
+                    score = self.KILLER
+                else:
+                    score = history[index]
+            scored.append((score, move))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [move for (_, move) in scored]
+
+    def record_cutoff(self, move: CoordPair, ply: int, depth: int):
+        """Remember a quiet move that caused a beta cutoff."""
+        index = self.move_index(move)
+        killers = self.killers.setdefault(ply, [])
+        if index not in killers:
+            killers.insert(0, index)
+            del killers[self.KILLERS_PER_PLY:]
+        self.history[index] += depth*depth
+
+class EvalAccumulator:
+    """Running totals behind e0, e1 and e2, so a leaf evaluation does not scan the board.
+
+    Game updates it wherever units appear, disappear or change health (and undoes those updates on unmake).
+    """
+    __slots__ = ('dim', 'pieces', 'material', 'health', 'type_count', 'ai_index', 'ai_health', 'distances')
+
+    def __init__(self, game: Game):
+        self.dim = game.options.dim
+        # occupied cells of each player (the game's own piece lists)
+        self.pieces = game._pieces
+        # per player (Player.value): e0 material, total health and number of units of each type
+        self.material = [0, 0]
+        self.health = [0, 0]
+        self.type_count = [[0]*len(UnitType), [0]*len(UnitType)]
+        # per player: cell index and health of its AI (-1 if none)
+        self.ai_index = [-1, -1]
+        self.ai_health = [0, 0]
+        # per player: number of its units at each Manhattan distance from the opponent's AI
+        self.distances = [[0]*(2*self.dim), [0]*(2*self.dim)]
+        for player in (Player.Attacker, Player.Defender):
+            for (coord, unit) in game.player_units(player):
+                self.add(coord.row*self.dim+coord.col, player, unit.type, unit.health)
+        # add() saw the piece lists already complete, so count the distances again from scratch
+        self.count_distances(Player.Attacker)
+        self.count_distances(Player.Defender)
+
+    def copy(self, game: Game) -> EvalAccumulator:
+        """Copy of the totals, for a cloned game."""
+        new = EvalAccumulator.__new__(EvalAccumulator)
+        new.dim = self.dim
+        new.pieces = game._pieces
+        new.material = list(self.material)
+        new.health = list(self.health)
+        new.type_count = [list(counts) for counts in self.type_count]
+        new.ai_index = list(self.ai_index)
+        new.ai_health = list(self.ai_health)
+        new.distances = [list(counts) for counts in self.distances]
+        return new
+
+    def distance(self, a: int, b: int) -> int:
+        """Manhattan distance between two cell indices."""
+        return abs(a // self.dim - b // self.dim) + abs(a % self.dim - b % self.dim)
+
+    def count_distances(self, player: Player):
+        """Recount the distances of a player's units to the opponent's AI (after that AI appeared or moved)."""
+        counts = self.distances[player.value] = [0]*(2*self.dim)
+        ai = self.ai_index[player.next().value]
+        if ai >= 0:
+            for index in self.pieces[player.value]:
+                counts[self.distance(index, ai)] += 1
+
+    def add(self, index: int, player: Player, unit_type: UnitType, health: int):
+        """A unit appeared on a cell index (its piece list entry must already be there)."""
+        p = player.value
+        self.material[p] += UNIT_VALUES[unit_type.value]
+        self.health[p] += health
+        self.type_count[p][unit_type.value] += 1
+        if unit_type == UnitType.AI:
+            self.ai_index[p] = index
+            self.ai_health[p] = health
+            self.count_distances(player.next())
+        ai = self.ai_index[1-p]
+        if ai >= 0:
+            self.distances[p][self.distance(index, ai)] += 1
+
+    def remove(self, index: int, player: Player, unit_type: UnitType, health: int):
+        """A unit left a cell index."""
+        p = player.value
+        self.material[p] -= UNIT_VALUES[unit_type.value]
+        self.health[p] -= health
+        self.type_count[p][unit_type.value] -= 1
+        ai = self.ai_index[1-p]
+        if ai >= 0:
+            self.distances[p][self.distance(index, ai)] -= 1
+        if unit_type == UnitType.AI and self.ai_index[p] == index:
+            self.ai_index[p] = -1
+            self.ai_health[p] = 0
+            self.distances[1-p] = [0]*(2*self.dim)
+
+    def change_health(self, player: Player, unit_type: UnitType, health_delta: int):
+        """A unit's health changed by health_delta."""
+        self.health[player.value] += health_delta
+        if unit_type == UnitType.AI:
+            self.ai_health[player.value] += health_delta
+
+    def terms(self, player: Player) -> Tuple[int, int, float]:
+        """Same values as (e0, e1, e2) for player."""
+        p = player.value
+        e0 = self.material[p] - self.material[1-p]
+        e1 = 0
+        e2 = 0
+        if self.ai_index[1-p] >= 0:
+            ai_health = self.ai_health[1-p]
+            counts = self.type_count[p]
+            e1 = self.health[p] - sum(counts)*ai_health
+            for (unit_type, count) in enumerate(counts):
+                if count:
+                    e1 += count*min(Unit.damage_table[unit_type][UnitType.AI.value], ai_health)
+            e2 = float('inf')
+            for (distance, count) in enumerate(self.distances[p]):
+                if count:
+                    e2 = distance
+                    break
+        return (e0, e1, e2)
 
 ##############################################################################################################
 
 @dataclass(slots=True)
 class Game:
     """Representation of the game state."""
-    board: list[list[Unit | None]] = field(default_factory=list)
+    board: list[list[Unit | None]] | CompactBoard = field(default_factory=list)
     next_player: Player = Player.Attacker
     turns_played : int = 0
     options: Options = field(default_factory=Options)
     stats: Stats = field(default_factory=Stats)
     _attacker_has_ai : bool = True
     _defender_has_ai : bool = True
-    
+    # undo log for make_move/unmake_move (UNDO_MOVE entries mark the start of each move)
+    _undo_log : list[tuple] = field(default_factory=list, repr=False)
+    # Zobrist hash of the position, kept up to date by set, change_health and next_turn
+    _hash : int = 0
+    _tt : TranspositionTable | None = field(default=None, repr=False)
+    # search deadline (perf_counter time) and node counter used to check it cheaply
+    _deadline : float | None = None
+    _nodes : int = 0
+    _orderer : MoveOrderer | None = field(default=None, repr=False)
+    # occupied cell indices of each player in board order (indexed by Player.value) and the cell index of each AI (-1 if none)
+    _pieces : tuple[list[int], list[int]] = field(default_factory=lambda: ([], []), repr=False)
+    _ai_index : list[int] = field(default_factory=lambda: [-1, -1], repr=False)
+    # running heuristic terms for EvalMode.Incremental (built on first use)
+    _eval : EvalAccumulator | None = field(default=None, repr=False)
+    # turns_played at the root of the current search (to know the ply of a node)
+    _root_turns : int = 0
+    # process pool of the root-parallel search and the alpha bound its workers share
+    _pool : ProcessPoolExecutor | None = field(default=None, repr=False)
+    _pool_alpha : object = field(default=None, repr=False)
+    _pool_stop : object = field(default=None, repr=False)
+    # event that stops the search of a Lazy SMP helper (None in the main searcher)
+    _stop : object = field(default=None, repr=False)
+    # counters of the current search (None when Options.collect_stats is off)
+    _search : SearchStats | None = field(default=None, repr=False)
+    # quiescence nodes searched so far in the current iteration, and the delta pruning margin set up per search
+    _qnodes : int = 0
+    _delta_margin : float = 0.0
+    # ply of the null move being searched (no null move right after another one)
+    _null_ply : int = -2
+    # opening book of Options.book (opened on first use)
+    _book : OpeningBook | None = field(default=None, repr=False)
+    # endgame tablebase of Options.tablebase (opened by iterative_deepening)
+    _tablebase : Tablebase | None = field(default=None, repr=False)
+    # search of the position after the opponent's expected reply, run by a thread while waiting for the reply,
+    # the hash of that position and start time of the search, and (in that search's game) its result
+    _ponder : Game | None = field(default=None, repr=False)
+    _ponder_thread : threading.Thread | None = field(default=None, repr=False)
+    _ponder_root : Tuple[int, float] = (0, 0.0)
+    _ponder_result : Tuple[int, CoordPair | None, float] | None = field(default=None, repr=False)
+    # client of Options.broker (connected on first use)
+    _broker : BrokerClient | None = field(default=None, repr=False)
+    # last move played by perform_move and its action (move, attack, repair or selfdestruct), for the game trace
+    _last_move : Tuple[CoordPair, str] | None = field(default=None, repr=False)
 
     def __post_init__(self):
         """Automatically called after class init to set up the default board state."""
         dim = self.options.dim
-        self.board = [[None for _ in range(dim)] for _ in range(dim)]
+        if self.options.compact_board:
+            self.board = CompactBoard(dim)
+        else:
+            self.board = [[None for _ in range(dim)] for _ in range(dim)]
         md = dim-1
         self.set(Coord(0,0),Unit(player=Player.Defender,type=UnitType.AI))
         self.set(Coord(1,0),Unit(player=Player.Defender,type=UnitType.Tech))
@@ -282,6 +1115,7 @@ class Game:
         self.set(Coord(md-2,md),Unit(player=Player.Attacker,type=UnitType.Program))
         self.set(Coord(md,md-2),Unit(player=Player.Attacker,type=UnitType.Program))
         self.set(Coord(md-1,md-1),Unit(player=Player.Attacker,type=UnitType.Firewall))
+        self._hash = self.compute_hash()
 
     def clone(self) -> Game:
         """Make a new copy of a game for minimax recursion.
@@ -289,42 +1123,98 @@ class Game:
         Shallow copy of everything except the board (options and stats are shared).
         """
         new = copy.copy(self)
-        new.board = copy.deepcopy(self.board)
+        if self.options.compact_board:
+            new.board = self.board.copy()
+        else:
+            new.board = copy.deepcopy(self.board)
+        new._undo_log = []
+        new._pieces = (list(self._pieces[0]), list(self._pieces[1]))
+        new._ai_index = list(self._ai_index)
+        if self._eval is not None:
+            new._eval = self._eval.copy(new)
         return new
 
     def is_empty(self, coord : Coord) -> bool:
         """Check if contents of a board cell of the game at Coord is empty (must be valid coord)."""
+        if self.options.compact_board:
+            return self.board.owner[coord.row*self.options.dim+coord.col] == 0
         return self.board[coord.row][coord.col] is None
 
-    def get(self, coord : Coord) -> Unit | None:
+    def get(self, coord : Coord) -> Unit | BoardUnit | None:
         """Get contents of a board cell of the game at Coord."""
         if self.is_valid_coord(coord):
+            if self.options.compact_board:
+                return self.board.get(coord.row*self.options.dim+coord.col)
             return self.board[coord.row][coord.col]
         else:
             return None
 
-    def set(self, coord : Coord, unit : Unit | None):
+    def set(self, coord : Coord, unit : Unit | BoardUnit | None):
         """Set contents of a board cell of the game at Coord."""
         if self.is_valid_coord(coord):
-            self.board[coord.row][coord.col] = unit
+            keys = ZobristKeys.for_dim(self.options.dim)
+            index = coord.row*self.options.dim+coord.col
+            old = self.get(coord)
+            old_piece = None
+            if old is not None:
+                old_piece = (old.player, old.type, old.health)
+                self._hash ^= keys.piece(index, old.player, old.type, old.health)
+            if unit is not None:
+                self._hash ^= keys.piece(index, unit.player, unit.type, unit.health)
+            if self.options.compact_board:
+                if self._undo_log:
+                    self._undo_log.append((UNDO_CELL, index, self.board.pack(index)))
+                self.board.set(index, unit)
+            else:
+                if self._undo_log:
+                    self._undo_log.append((UNDO_CELL, index, old))
+                self.board[coord.row][coord.col] = unit
+            self.update_pieces(index, old_piece, unit)
+
+    def update_pieces(self, index: int, old_piece: Tuple[Player, UnitType, int] | None, unit: Unit | BoardUnit | None):
+        """Keep the piece lists (and eval accumulator) in step with a cell index that changed from old_piece (player, type, health) to unit."""
+        if old_piece is not None:
+            pieces = self._pieces[old_piece[0].value]
+            del pieces[bisect.bisect_left(pieces, index)]
+            if old_piece[1] == UnitType.AI and self._ai_index[old_piece[0].value] == index:
+                self._ai_index[old_piece[0].value] = -1
+            if self._eval is not None:
+                self._eval.remove(index, old_piece[0], old_piece[1], old_piece[2])
+        if unit is not None:
+            bisect.insort(self._pieces[unit.player.value], index)
+            if unit.type == UnitType.AI:
+                self._ai_index[unit.player.value] = index
+            if self._eval is not None:
+                self._eval.add(index, unit.player, unit.type, unit.health)
+
+    def ai_coord(self, player: Player) -> Coord | None:
+        """Coord of a player's AI (None if it is not on the board)."""
+        index = self._ai_index[player.value]
+        if index < 0:
+            return None
+        return NeighbourTables.for_dim(self.options.dim).coords[index]
 
     def remove_dead(self, coord: Coord):
         """Remove unit at Coord if dead."""
         unit = self.get(coord)
         if unit is not None and not unit.is_alive():
+            # read the unit before its cell is cleared (a BoardUnit is only a view on the cell)
+            unit_type = unit.type
+            player = unit.player
             self.set(coord,None)
-            if unit.type == UnitType.AI:
-                if unit.player == Player.Attacker:
+            if unit_type == UnitType.AI:
+                if self._undo_log:
+                    self._undo_log.append((UNDO_AI, player, self._attacker_has_ai, self._defender_has_ai))
+                if player == Player.Attacker:
                     self._attacker_has_ai = False
                 else:
                     self._defender_has_ai = False
 
     # checks board before next turn starts to remove any dead pieces
     def check_dead(self):
-        all_coords = CoordPair(Coord(0, 0), Coord(4, 4)).iter_rectangle()
-        for coord in all_coords:
-            if self.get(coord) is not None:
-                unit = self.get(coord)
+        for player in (Player.Attacker, Player.Defender):
+            # (remove_dead changes the piece list)
+            for (coord, unit) in list(self.player_units(player)):
                 if not unit.is_alive():
                     self.remove_dead(coord)
 
@@ -332,9 +1222,32 @@ class Game:
         """Modify health of unit at Coord (positive or negative delta)."""
         target = self.get(coord)
         if target is not None:
-            target.mod_health(health_delta)
+            self.change_health(coord, target, health_delta)
             self.remove_dead(coord)
 
+    def change_health(self, coord : Coord, unit : Unit, health_delta : int):
+        """Modify health of the unit at Coord without removing it, recording the change in the undo log."""
+        if self._undo_log:
+            self._undo_log.append((UNDO_HEALTH, unit, unit.health))
+        keys = ZobristKeys.for_dim(self.options.dim)
+        index = coord.row*self.options.dim+coord.col
+        self._hash ^= keys.piece(index, unit.player, unit.type, unit.health)
+        old_health = unit.health
+        unit.mod_health(health_delta)
+        self._hash ^= keys.piece(index, unit.player, unit.type, unit.health)
+        if self._eval is not None:
+            self._eval.change_health(unit.player, unit.type, unit.health - old_health)
+
+    def compute_hash(self) -> int:
+        """Zobrist hash of the position computed from scratch (the incremental _hash must always match it)."""
+        keys = ZobristKeys.for_dim(self.options.dim)
+        value = keys.side if self.next_player == Player.Defender else 0
+        for coord in CoordPair.from_dim(self.options.dim).iter_rectangle():
+            unit = self.get(coord)
+            if unit is not None:
+                value ^= keys.piece(coord.row*self.options.dim+coord.col, unit.player, unit.type, unit.health)
+        return value
+
     def is_valid_move(self, coords: CoordPair) -> bool:
         "Validate a move expressed as a CoordPair."
         # validate that the coordinates (source and destination) are valid
@@ -346,51 +1259,55 @@ class Game:
         unit = self.get(coords.src)                                                             #Checks what unit is at source using "get" method
         if unit is None or unit.player != self.next_player:                                       #Checks if there is NO unit at soruce or checks if the player of the unit is not the same as the next player whose supposed to make the move
             return False
+
         # validate that the move is to an adjacent space (or to same space)
-        
-        
-        # validate that the move is to an adjacent space
-        adjacent_coords = coords.src.iter_adjacent()
-        adjacentMove = False
-        selfDestruct = False
-        for coord in adjacent_coords:
-            if coord == coords.dst:
-                adjacentMove = True
-        if coords.src == coords.dst:
-                selfDestruct = True
-        if not adjacentMove and not selfDestruct:
+        dim = self.options.dim
+        src_index = coords.src.row*dim+coords.src.col
+        dst_index = coords.dst.row*dim+coords.dst.col
+        if dst_index != src_index and dst_index not in NeighbourTables.for_dim(dim).adjacent[src_index]:
             return False
-        
+        return self.is_valid_step(src_index, dst_index, unit)
+
+    def get_index(self, index: int) -> Unit | BoardUnit | None:
+        """Get contents of a board cell of the game by cell index (row*dim+col, must be valid)."""
+        if self.options.compact_board:
+            return self.board.get(index)
+        (row, col) = divmod(index, self.options.dim)
+        return self.board[row][col]
+
+    def is_engaged_in_combat(self, index: int, player: Player) -> bool:
+        """Is a unit of player at cell index next to an adversarial unit ?"""
+        for adjacent in NeighbourTables.for_dim(self.options.dim).adjacent[index]:
+            unit = self.get_index(adjacent)
+            if unit is not None and unit.player != player:
+                return True
+        return False
+
+    def is_valid_step(self, src_index: int, dst_index: int, unit: Unit | BoardUnit) -> bool:
+        """Validate a move of the next player's unit to an adjacent cell index (or its own cell)."""
         # validate that the movement is valid (if destination is an open spot)
-        unit = self.get(coords.dst)                                                         #Checks to see if there is unit at destination.
-        if unit is None:
-            adversarial_units = [self.get(coord) for coord in adjacent_coords if self.is_valid_coord(coord) and self.get(coord) is not None]
-            unit = self.get(coords.src)
+        target = self.get_index(dst_index)
+        if target is None:
             if unit.type in (UnitType.AI, UnitType.Firewall, UnitType.Program):
-               
-               
                 # AI, Firewall, or Program cannot move if engaged in combat
-                if any(unit for unit in adversarial_units if unit.player != unit.player):
+                if self.is_engaged_in_combat(src_index, unit.player):
                     return False
-                
-                
+
+                dim = self.options.dim
                 # Attacker's AI, Firewall, or Program can only move up or left
                 if unit.player == Player.Attacker:
-                    if coords.src.row < coords.dst.row or coords.src.col < coords.dst.col:
+                    if src_index // dim < dst_index // dim or src_index % dim < dst_index % dim:
                         return False
-                
-                
+
                 # Defender's AI, Firewall, or Program can only move down or right
                 else:
-                    if coords.src.row > coords.dst.row or coords.src.col > coords.dst.col:
-                        return False        
-
-                #cannot repair a team mate with full health, not a valid move
-                
-        elif unit is not None:
-            if unit.player==self.next_player:
-                if unit.health==unit.Max_health:
-                    return False
+                    if src_index // dim > dst_index // dim or src_index % dim > dst_index % dim:
+                        return False
+
+        #cannot repair a team mate with full health, not a valid move
+        elif target.player == self.next_player:
+            if target.health == target.Max_health:
+                return False
         return True
 
     ###   ACTIONS   ###
@@ -408,21 +1325,22 @@ class Game:
         #repair objects 
         health_boost = src_unit.repair_amount(dst_unit)
         #add repair amount from the Units
-        dst_unit.mod_health(+(health_boost))
+        self.change_health(coords.dst, dst_unit, +(health_boost))
 
     # Self-destruct action
     def selfdestruct(self, coords: CoordPair):
         # Unit object for source
         src_unit = self.get(coords.src)
         # subtract all health from source Unit
-        src_unit.mod_health(-9)
-        # make list of adjacent and diagonal spots
-        adjacent_and_diagonal = coords.src.iter_adjacent_and_diagonal()
+        self.change_health(coords.src, src_unit, -9)
+        # adjacent and diagonal spots (already clipped to the board)
+        tables = NeighbourTables.for_dim(self.options.dim)
+        adjacent_and_diagonal = tables.around[coords.src.row*self.options.dim+coords.src.col]
         # remove health from adjacent and diagonal spots (if occupied)
-        for coord in adjacent_and_diagonal:
-            unit = self.get(coord)
+        for index in adjacent_and_diagonal:
+            unit = self.get_index(index)
             if unit is not None:
-                unit.mod_health(-2)        
+                self.change_health(tables.coords[index], unit, -2)
 
     # Attack action
     def attack(self, coords: CoordPair):
@@ -432,38 +1350,96 @@ class Game:
         # damage amount for source attack on target
         damage = src_unit.damage_amount(dst_unit)
         # subtract damage amount from the Units
-        src_unit.mod_health(-(damage))
-        dst_unit.mod_health(-(damage))
+        self.change_health(coords.src, src_unit, -(damage))
+        self.change_health(coords.dst, dst_unit, -(damage))
 
     ####################
-       
+
+    def apply_move(self, coords: CoordPair) -> str:
+        """Perform an already validated move and return which action it was."""
+        unit = self.get(coords.dst)
+        # Movement: (destination is empty)
+        if unit == None:
+            self.movement(coords)
+            return 'move'
+        # Self-destruct: (destination is same as source)
+        elif unit.player == self.next_player and coords.src == coords.dst:
+            self.selfdestruct(coords)
+            return 'selfdestruct'
+        # Repair: (destination occupied by a teammate)
+        elif unit.player == self.next_player:
+            self.repair(coords)
+            return 'repair'
+        # Attack: (destination occupied by other player)
+        else:
+            self.attack(coords)
+            return 'attack'
+
     def perform_move(self, coords: CoordPair) -> Tuple[bool, str]:
         """Validate and perform a move expressed as a CoordPair."""
         # if move is valid, then figure out which type of action to take:
         if self.is_valid_move(coords):
-            unit = self.get(coords.dst)
-            # Movement: (destination is empty)
-            if unit == None: 
-                self.movement(coords)
+            action = self.apply_move(coords)
+            self._last_move = (coords, action)
+            if action == 'move':
                 return (True, 'move from ' + str(coords.src) + ' to ' + str(coords.dst))
-            # Self-destruct: (destination is same as source)
-            elif unit.player == self.next_player and coords.src == coords.dst:
-                self.selfdestruct(coords)
+            elif action == 'selfdestruct':
                 return (True, 'player at ' + str(coords.src) + ' did a self-destruct')
-            # Repair: (destination occupied by a teammate)
-            elif unit.player == self.next_player:
-                self.repair(coords)
+            elif action == 'repair':
                 return (True, 'player at ' + str(coords.src) + ' repaired teammate at ' + str(coords.dst))
-            # Attack: (destination occupied by other player)
-            elif unit.player != self.next_player:
-                self.attack(coords)
+            else:
                 return (True, 'player at ' + str(coords.src) + ' attacked opponent at ' + str(coords.dst))
         return (False, "Invalid move")
-    
-    
+
+    def make_null_move(self):
+        """Pass the turn without moving, in place (take it back with unmake_move)."""
+        self._undo_log.append((UNDO_MOVE, self._hash))
+        self.next_turn()
+
+    def make_move(self, coords: CoordPair):
+        """Play a move from move_candidates and pass the turn, in place (take it back with unmake_move)."""
+        self._undo_log.append((UNDO_MOVE, self._hash))
+        self.apply_move(coords)
+        self.next_turn()
+
+    def unmake_move(self):
+        """Take back the last move played with make_move."""
+        log = self._undo_log
+        board = self.board
+        compact = self.options.compact_board
+        while True:
+            entry = log.pop()
+            tag = entry[0]
+            if tag == UNDO_MOVE:
+                self._hash = entry[1]
+                return
+            elif tag == UNDO_HEALTH:
+                unit = entry[1]
+                if self._eval is not None:
+                    self._eval.change_health(unit.player, unit.type, entry[2] - unit.health)
+                unit.health = entry[2]
+            elif tag == UNDO_CELL:
+                index = entry[1]
+                current = self.get_index(index)
+                current_piece = None if current is None else (current.player, current.type, current.health)
+                if compact:
+                    board.unpack(index, entry[2])
+                else:
+                    (row, col) = divmod(index, self.options.dim)
+                    board[row][col] = entry[2]
+                self.update_pieces(index, current_piece, self.get_index(index))
+            elif tag == UNDO_AI:
+                self._attacker_has_ai = entry[2]
+                self._defender_has_ai = entry[3]
+            else:
+                self.next_player = entry[1]
+                self.turns_played = entry[2]
 
     def next_turn(self):
         """Transitions game to the next turn."""
+        if self._undo_log:
+            self._undo_log.append((UNDO_TURN, self.next_player, self.turns_played))
+        self._hash ^= ZobristKeys.for_dim(self.options.dim).side
         self.next_player = self.next_player.next()
         self.turns_played += 1
         self.check_dead()
@@ -522,6 +1498,46 @@ class Game:
     def __str__(self) -> str:
         """Default string representation of a game."""
         return self.to_string()
+
+    def to_position_string(self) -> str:
+        """One line text of the position: rows separated by '/', cells by ',' ('.' if empty), next player and turns played.
+
+        ex: dA9,dT9,dF9,.,./dT9,dP9,.,.,./dF9,.,.,.,aP9/.,.,.,aF9,aV9/.,.,aP9,aV9,aA9 a 0
+        """
+        dim = self.options.dim
+        rows = []
+        for row in range(dim):
+            cells = (self.board_cell_string(row*dim+col) for col in range(dim))
+            rows.append(",".join(cells))
+        return f"{'/'.join(rows)} {self.next_player.name.lower()[0]} {self.turns_played}"
+
+    def board_cell_string(self, index: int) -> str:
+        """Text of the unit at a cell index ('.' if empty)."""
+        unit = self.get_index(index)
+        return "." if unit is None else unit.to_string()
+
+    @classmethod
+    def from_position_string(cls, s: str, options: Options | None = None) -> Game:
+        """Create a game from the text of to_position_string (the board size comes from the text)."""
+        (board, player, turns) = s.split()
+        rows = board.split('/')
+        options = copy.copy(options) if options is not None else Options()
+        options.dim = len(rows)
+        game = Game(options=options)
+        for coord in CoordPair.from_dim(options.dim).iter_rectangle():
+            game.set(coord, None)
+        for (row, cells) in enumerate(rows):
+            for (col, cell) in enumerate(cells.split(',')):
+                if cell != '.':
+                    unit_player = Player.Attacker if cell[0] == 'a' else Player.Defender
+                    unit_type = next(t for t in UnitType if t.name[0] == cell[1].upper())
+                    game.set(Coord(row, col), Unit(player=unit_player, type=unit_type, health=int(cell[2:])))
+        game.next_player = Player.Attacker if player[0].lower() == 'a' else Player.Defender
+        game.turns_played = int(turns)
+        game._attacker_has_ai = game._ai_index[Player.Attacker.value] >= 0
+        game._defender_has_ai = game._ai_index[Player.Defender.value] >= 0
+        game._hash = game.compute_hash()
+        return game
     
     def is_valid_coord(self, coord: Coord) -> bool:
         """Check if a Coord is valid within out board dimensions."""
@@ -541,7 +1557,8 @@ class Game:
                 print('Invalid coordinates! Try again.')
     
     def human_turn(self) -> str:
-        """Human player plays a move (or get via broker)."""
+        """Human player plays a move (or get via broker), the computer pondering meanwhile if it plays next."""
+        self.start_ponder()
         if self.options.broker is not None:
             print("Getting next move with auto-retry from game broker...")
             while True:
@@ -552,7 +1569,8 @@ class Game:
                     print(result)
                     if success:
                         self.next_turn()
-                        break
+                        return result
+                # the broker keeps serving the same (invalid) move until it gets a new one
                 sleep(0.1)
         else:
             while True:
@@ -572,17 +1590,21 @@ class Game:
         if mv is not None:
             (success,result) = self.perform_move(mv)
             if success:
-                print(f"Computer {self.next_player.name}: ",end='')
-                print(result)
+                if self.options.verbose:
+                    print(f"Computer {self.next_player.name}: ",end='')
+                    print(result)
                 self.next_turn()
         return mv
 
     def player_units(self, player: Player) -> Iterable[Tuple[Coord,Unit]]:
-        """Iterates over all units belonging to a player."""
-        for coord in CoordPair.from_dim(self.options.dim).iter_rectangle():
-            unit = self.get(coord)
-            if unit is not None and unit.player == player:
-                yield (coord,unit)
+        """Iterates over all units belonging to a player (in board order, Coords are shared; do not add or remove units meanwhile)."""
+        coords = NeighbourTables.for_dim(self.options.dim).coords
+        for index in self._pieces[player.value]:
+            yield (coords[index],self.get_index(index))
+
+    def unit_healths(self) -> dict[int, int]:
+        """Health of every unit on the board by cell index."""
+        return {index: self.get_index(index).health for pieces in self._pieces for index in pieces}
 
     def is_finished(self) -> bool:
         """Check if the game is over."""
@@ -600,15 +1622,15 @@ class Game:
         return Player.Defender
 
     def move_candidates(self) -> Iterable[CoordPair]:
-        """Generate valid move candidates for the next player."""
-        move = CoordPair()
-        for (src,_) in self.player_units(self.next_player):
-            move.src = src
-            for dst in src.iter_adjacent():
-                move.dst = dst
-                if self.is_valid_move(move):
-                    yield move.clone()
-            
+        """Generate valid move candidates for the next player (their Coords are shared, do not modify them)."""
+        dim = self.options.dim
+        tables = NeighbourTables.for_dim(dim)
+        coords = tables.coords
+        for (src,unit) in self.player_units(self.next_player):
+            src_index = src.row*dim+src.col
+            for dst_index in tables.adjacent[src_index]:
+                if self.is_valid_step(src_index, dst_index, unit):
+                    yield CoordPair(coords[src_index], coords[dst_index])
 
     def random_move(self) -> Tuple[int, CoordPair | None, float]:
         """Returns a random move."""
@@ -620,129 +1642,763 @@ class Game:
             return (0, None, 0)
         
 
-    def e2(self) -> int: #shortest distance
+    def e2(self, player: Player | None = None) -> int: #shortest distance
+        if player is None:
+            player = self.next_player
         score = 0
         # identify the coordinates of the opposing player's AI unit
-        opposing_ai_coord = next((unit for coord, unit in self.player_units(self.next_player.next()) if unit.type == UnitType.AI), None)
-        if not opposing_ai_coord:
-            return score  # if AI unit not found
-        for coord, unit in self.player_units(self.next_player.next()):
-            if unit.type == UnitType.AI:
-                opposing_ai_coord = coord
-                break  # Exit loop once opposing AI is found
-
-
+        opposing_ai_coord = self.ai_coord(player.next())
         if opposing_ai_coord is None:
-            return self.options.dim * 2
+            return score  # if AI unit not found
 
         # Manhattan distance from each of the player's units to the opposing AI
         shortest_distance = float('inf')  # Initialize to infinity
-        for coord, unit in self.player_units(self.next_player):
+        for coord, unit in self.player_units(player):
             distance = abs(coord.row - opposing_ai_coord.row) + abs(coord.col - opposing_ai_coord.col)
             shortest_distance = min(shortest_distance, distance)
 
         return shortest_distance
 
-    def e1(self) -> int:
+    def e1(self, player: Player | None = None) -> int:
+        if player is None:
+            player = self.next_player
         score = 0
         # identify the coordinates of the opposing player's AI unit
-        opposing_ai_coord =  next((unit for coord, unit in self.player_units(self.next_player.next()) if unit.type == UnitType.AI), None)
-        for coord, unit in self.player_units(self.next_player.next()):
-            if unit.type == UnitType.AI:
-                opposing_ai_coord = coord
-                break  # Exit loop once opposing AI is found
+        opposing_ai_coord = self.ai_coord(player.next())
         if opposing_ai_coord is None:
             return score  # if AI unit not found
 
         opposing_ai_unit = self.get(opposing_ai_coord)
-        for coord, unit in self.player_units(self.next_player):
+        for coord, unit in self.player_units(player):
             score += unit.health - opposing_ai_unit.health + unit.damage_amount(opposing_ai_unit)
 
         return score
 
 
-    def e0(self) -> int:
-        if(self.next_player == Player.Attacker):
-            attackerUnits = self.player_units(self.next_player)
-            defenderUnits = self.player_units(self.next_player.next())
-        else:
-            defenderUnits = self.player_units(self.next_player)
-            attackerUnits = self.player_units(self.next_player.next())
-        
-        attackerScore = 0
-        defenderScore = 0
+    def e0(self, player: Player | None = None) -> int:
+        if player is None:
+            player = self.next_player
+        playerScore = 0
+        opponentScore = 0
         score = 0
 
-        for coordinates, units in attackerUnits:
-            if Unit.type == UnitType.AI:
-                attackerScore += 9999
-            elif Unit.type == UnitType.Tech:
-                attackerScore += 3
-            elif Unit.type == UnitType.Virus:
-                attackerScore += 3
-            elif Unit.type == UnitType.Program:
-                attackerScore += 3
-            elif Unit.type == UnitType.Firewall:
-                attackerScore += 3
-        
-        for coordinates, units in defenderUnits:
-            if Unit.type == UnitType.AI:
-                defenderScore += 9999
-            elif Unit.type == UnitType.Tech:
-                defenderScore += 3
-            elif Unit.type == UnitType.Virus:
-                defenderScore += 3
-            elif Unit.type == UnitType.Program:
-                defenderScore += 3
-            elif Unit.type == UnitType.Firewall:
-                defenderScore += 3
-
-        score = attackerScore - defenderScore
+        for coordinates, unit in self.player_units(player):
+            playerScore += UNIT_VALUES[unit.type.value]
+
+        for coordinates, unit in self.player_units(player.next()):
+            opponentScore += UNIT_VALUES[unit.type.value]
+
+        score = playerScore - opponentScore
         return score
 
+    def fused_terms(self, player: Player) -> Tuple[int, int, float]:
+        """Same values as (e0, e1, e2) for player, in one pass over the units of both players."""
+        dim = self.options.dim
+        p = player.value
+        damage_table = Unit.damage_table
+        # the opposing AI is known from the piece lists, so every term can be added up in the same loop
+        ai = self._ai_index[1-p]
+        has_ai = ai >= 0
+        (ai_row, ai_col) = divmod(ai, dim)
+        compact = self.options.compact_board
+        if compact:
+            board = self.board
+            healths = board.health
+            types = board.type
+            ai_health = healths[ai] if has_ai else 0
+        else:
+            rows = self.board
+            ai_health = rows[ai_row][ai_col].health if has_ai else 0
+        e0 = 0
+        e1 = 0
+        e2 = float('inf')
+        for index in self._pieces[p]:
+            if compact:
+                unit_type = types[index]
+                health = healths[index]
+            else:
+                unit = rows[index // dim][index % dim]
+                unit_type = unit.type.value
+                health = unit.health
+            e0 += UNIT_VALUES[unit_type]
+            if has_ai:
+                damage = damage_table[unit_type][0]
+                e1 += health - ai_health + (damage if damage < ai_health else ai_health)
+                distance = abs(index // dim - ai_row) + abs(index % dim - ai_col)
+                if distance < e2:
+                    e2 = distance
+        for index in self._pieces[1-p]:
+            if compact:
+                e0 -= UNIT_VALUES[types[index]]
+            else:
+                e0 -= UNIT_VALUES[rows[index // dim][index % dim].type.value]
+        if not has_ai:
+            e2 = 0
+        return (e0, e1, e2)
+
+    def evaluate(self, player: Player) -> float:
+        """Combined heuristic score of the position for player, computed as Options.eval_mode says."""
+        mode = self.options.eval_mode
+        if mode == EvalMode.Fused:
+            terms = self.fused_terms(player)
+        elif mode == EvalMode.Incremental:
+            if self._eval is None:
+                self._eval = EvalAccumulator(self)
+            terms = self._eval.terms(player)
+        else:
+            terms = (self.e0(player), self.e1(player), self.e2(player))
+        if self.options.eval_parity and mode != EvalMode.Classic:
+            # test mode: every evaluation must match the separate heuristic functions
+            expected = (self.e0(player), self.e1(player), self.e2(player))
+            if terms != expected:
+                raise AssertionError(f"{mode.name} evaluation {terms} differs from e0/e1/e2 {expected} for {player.name}:\n{self}")
+        weights = self.options.eval_weights
+        return (terms[0]*weights.w0 + terms[1]*weights.w1 + terms[2]*weights.w2)/weights.scale
+
     
+    def tt_key(self, root_player: Player) -> int:
+        """Transposition table key of the position searched for root_player.
+
+        Tablebase results and the turn limit depend on the turns left, which the position hash leaves out,
+        so with a tablebase loaded or the limit within TURN_LIMIT_HORIZON turns they are part of the key.
+        """
+        keys = ZobristKeys.for_dim(self.options.dim)
+        key = self._hash ^ keys.perspective[root_player.value]
+        max_turns = self.options.max_turns
+        if max_turns is not None and (self._tablebase is not None or max_turns - self.turns_played <= TURN_LIMIT_HORIZON):
+            key ^= keys.turns_left(max_turns - self.turns_played)
+        return key
+
+    def finished_score(self, root_player: Player, ply: int) -> int:
+        """Score of a finished game for root_player on the tablebase scale: a win (or loss) ply plies from the root."""
+        score = TABLEBASE_WIN - ply
+        return score if self.has_winner() == root_player else -score
+
+    def tt_move(self, src: int, dst: int) -> CoordPair | None:
+        """Move stored in a transposition table entry as a CoordPair."""
+        if src == TranspositionTable.NO_MOVE:
+            return None
+        dim = self.options.dim
+        return CoordPair(Coord(src // dim, src % dim), Coord(dst // dim, dst % dim))
+
+    def record_cutoff(self, move: CoordPair, move_number: int, ply: int, depth: int):
+        """Count a cutoff and let the move orderer learn from it (if the move was quiet)."""
+        search = self._search
+        if search is not None:
+            search.cutoffs += 1
+            if move_number == 0:
+                search.first_move_cutoffs += 1
+        if self._orderer is not None:
+            target = self.get(move.dst)
+            if target is None or target.player == self.next_player:
+                self._orderer.record_cutoff(move, ply, depth)
+
     def minimax(self, depth: int, alpha: int, beta: int, maximizing_player: bool) -> Tuple[int, CoordPair | None, float]:
-        if depth == 0 or self.is_finished():
-            return ((self.e0() + -self.e1() + -self.e2())/3, None, depth)
+        self._nodes += 1
+        if self._nodes & (DEADLINE_CHECK_INTERVAL-1) == 0 and self.search_stopped():
+            raise SearchTimeout()
+        ply = self.turns_played - self._root_turns
+        search = self._search
+        if search is not None:
+            search.nodes_per_depth[ply] = search.nodes_per_depth.get(ply, 0) + 1
+        finished = self.is_finished()
+        tablebase = self._tablebase
+        if tablebase is not None and ply > 0 and not finished:
+            # solved endgame: exact result, shorter wins (and longer losses) first
+            result = tablebase.probe(self)
+            if result is not None:
+                if search is not None:
+                    search.tablebase_hits += 1
+                root_player = self.next_player if maximizing_player else self.next_player.next()
+                score = TABLEBASE_WIN - ply - result[1]
+                return (score if result[0] == root_player else -score, None, depth)
+        if depth == 0 and not finished and self.options.quiescence:
+            return (self.quiescence(alpha, beta, maximizing_player, ply), None, depth)
+        if depth == 0 or finished:
+            # leaves are scored from the point of view of the player at the root of the search
+            player = self.next_player if maximizing_player else self.next_player.next()
+            if search is not None:
+                search.evaluations_per_depth[ply] = search.evaluations_per_depth.get(ply, 0) + 1
+            if finished and tablebase is not None:
+                # on the scale of the tablebase results, so that a win now beats a solved win later
+                return (self.finished_score(player, ply), None, depth)
+            return (self.evaluate(player), None, depth)
+        # a deep enough transposition table entry can answer (or narrow the window) without searching
+        tt = self._tt
+        pv_move = -1
+        if tt is not None:
+            root_player = self.next_player if maximizing_player else self.next_player.next()
+            tt_key = self.tt_key(root_player)
+            entry = tt.probe(tt_key)
+            if search is not None:
+                search.tt_probes += 1
+                if entry is not None:
+                    search.tt_hits += 1
+            if entry is not None:
+                (entry_depth, flag, score, src, dst) = entry
+                score = score_from_tt(score, ply)
+                if src != TranspositionTable.NO_MOVE:
+                    pv_move = src*self.options.dim*self.options.dim + dst
+                if entry_depth >= depth:
+                    if flag == TT_EXACT:
+                        return (score, self.tt_move(src, dst), depth)
+                    elif flag == TT_LOWER:
+                        alpha = max(alpha, score)
+                    else:
+                        beta = min(beta, score)
+                    if beta <= alpha:
+                        return (score, self.tt_move(src, dst), depth)
+        # null-move pruning: if passing still fails high (or low), a real move surely would too
+        if (self.options.null_move and depth >= NULL_MOVE_MIN_DEPTH and self._null_ply != ply - 1
+                and len(self._pieces[self.next_player.value]) >= NULL_MOVE_MIN_UNITS):
+            score = self.null_move_search(depth, alpha, beta, maximizing_player, ply)
+            if score is not None:
+                return (score, None, depth)
+        window = (alpha, beta)
+        moves = list(self.move_candidates())
+        orderer = self._orderer
+        if orderer is not None:
+            if ply == 0 and pv_move < 0:
+                pv_move = orderer.root_move
+            moves = orderer.order(self, moves, ply, pv_move)
+        best_move = None
+        # principal variation search: after the first move, only check that a move is no better (null window)
+        pvs = self.options.pvs
+        # late move reductions: quiet moves ordered late are first searched one ply shallower
+        lmr = self.options.lmr and depth >= LMR_MIN_DEPTH
         if maximizing_player:
-            max_eval = MIN_HEURISTIC_SCORE
-            moves = list(self.move_candidates())
-            best_move = None
-            for move in moves:
-                game_state = self.clone()
-                game_state.perform_move(move)
-                eval = game_state.minimax(depth - 1, alpha, beta, False)[0] 
-                if eval > max_eval:
-                    max_eval = eval
+            best_eval = MIN_HEURISTIC_SCORE
+            for (i, move) in enumerate(moves):
+                reduced = lmr and i >= LMR_FULL_MOVES and self.is_empty(move.dst)
+                self.make_move(move)
+                if reduced:
+                    # only a reduced search that shows the move is no better is trusted
+                    eval = self.minimax(depth - 2, alpha, alpha + NULL_WINDOW, False)[0]
+                    if search is not None:
+                        search.lmr_reductions += 1
+                    if eval > alpha:
+                        reduced = False
+                        if search is not None:
+                            search.lmr_researches += 1
+                if not reduced:
+                    if pvs and i > 0 and beta - alpha > NULL_WINDOW:
+                        eval = self.minimax(depth - 1, alpha, alpha + NULL_WINDOW, False)[0]
+                        if alpha < eval < beta:
+                            if search is not None:
+                                search.pvs_researches += 1
+                            eval = self.minimax(depth - 1, alpha, beta, False)[0]
+                    else:
+                        eval = self.minimax(depth - 1, alpha, beta, False)[0]
+                self.unmake_move()
+                if eval > best_eval:
+                    best_eval = eval
                     best_move = move
                 alpha = max(alpha, eval)
                 if beta <= alpha:
+                    self.record_cutoff(move, i, ply, depth)
                     break
-            return (max_eval, best_move, depth)
         else:
-            min_eval = MAX_HEURISTIC_SCORE
-            moves = list(self.move_candidates())
-            best_move = None
-            for move in moves:
-                game_state = self.clone()
-                game_state.perform_move(move)
-                eval = game_state.minimax(depth - 1, alpha, beta, True)[0]
-                if eval < min_eval:
-                    min_eval = eval
+            best_eval = MAX_HEURISTIC_SCORE
+            for (i, move) in enumerate(moves):
+                reduced = lmr and i >= LMR_FULL_MOVES and self.is_empty(move.dst)
+                self.make_move(move)
+                if reduced:
+                    # only a reduced search that shows the move is no better is trusted
+                    eval = self.minimax(depth - 2, beta - NULL_WINDOW, beta, True)[0]
+                    if search is not None:
+                        search.lmr_reductions += 1
+                    if eval < beta:
+                        reduced = False
+                        if search is not None:
+                            search.lmr_researches += 1
+                if not reduced:
+                    if pvs and i > 0 and beta - alpha > NULL_WINDOW:
+                        eval = self.minimax(depth - 1, beta - NULL_WINDOW, beta, True)[0]
+                        if alpha < eval < beta:
+                            if search is not None:
+                                search.pvs_researches += 1
+                            eval = self.minimax(depth - 1, alpha, beta, True)[0]
+                    else:
+                        eval = self.minimax(depth - 1, alpha, beta, True)[0]
+                self.unmake_move()
+                if eval < best_eval:
+                    best_eval = eval
                     best_move = move
                 beta = min(beta, eval)
                 if beta <= alpha:
+                    self.record_cutoff(move, i, ply, depth)
                     break
-            return (min_eval, best_move, depth)
+        if tt is not None:
+            if best_eval <= window[0]:
+                flag = TT_UPPER
+            elif best_eval >= window[1]:
+                flag = TT_LOWER
+            else:
+                flag = TT_EXACT
+            if best_move is None:
+                (src, dst) = (TranspositionTable.NO_MOVE, TranspositionTable.NO_MOVE)
+            else:
+                dim = self.options.dim
+                (src, dst) = (best_move.src.row*dim+best_move.src.col, best_move.dst.row*dim+best_move.dst.col)
+            tt.store(tt_key, depth, flag, score_to_tt(best_eval, ply), src, dst)
+        return (best_eval, best_move, depth)
+
+    def null_move_search(self, depth: int, alpha: float, beta: float, maximizing_player: bool, ply: int) -> float | None:
+        """Let the side to move pass and search the reply at reduced depth with a null window on its bound.
+
+        Returns the score to cut off with, or None if passing does not prove the node fails high (or low).
+        Only tried when the static evaluation already is at or beyond the bound.
+        """
+        player = self.next_player if maximizing_player else self.next_player.next()
+        if maximizing_player:
+            if beta >= MAX_HEURISTIC_SCORE or self.evaluate(player) < beta:
+                return None
+        elif alpha <= MIN_HEURISTIC_SCORE or self.evaluate(player) > alpha:
+            return None
+        search = self._search
+        if search is not None:
+            search.null_move_tries += 1
+        previous = self._null_ply
+        self._null_ply = ply
+        self.make_null_move()
+        if maximizing_player:
+            score = self.minimax(depth - 1 - NULL_MOVE_REDUCTION, beta - NULL_WINDOW, beta, False)[0]
+            cutoff = score >= beta
+        else:
+            score = self.minimax(depth - 1 - NULL_MOVE_REDUCTION, alpha, alpha + NULL_WINDOW, True)[0]
+            cutoff = score <= alpha
+        self.unmake_move()
+        self._null_ply = previous
+        if not cutoff:
+            return None
+        if search is not None:
+            search.null_move_cutoffs += 1
+        return score
+
+    def tactical_moves(self) -> list[Tuple[int, CoordPair]]:
+        """Attacks and self-destructs (that hit an enemy) of the next player, best first.
+
+        Each comes with the most material it can win: the e0 value of every enemy unit the damage table
+        says it can kill. Attacks and self-destructs also hurt friendly units, which this ignores.
+        """
+        dim = self.options.dim
+        tables = NeighbourTables.for_dim(dim)
+        coords = tables.coords
+        damage_table = Unit.damage_table
+        player = self.next_player
+        moves = []
+        for (src, unit) in self.player_units(player):
+            src_index = src.row*dim+src.col
+            for dst_index in tables.adjacent[src_index]:
+                target = self.get_index(dst_index)
+                if target is not None and target.player != player:
+                    damage = damage_table[unit.type.value][target.type.value]
+                    gain = UNIT_VALUES[target.type.value] if damage >= target.health else 0
+                    moves.append((gain, damage, CoordPair(src, coords[dst_index])))
+            if self.is_valid_step(src_index, src_index, unit):
+                hits = 0
+                gain = 0
+                for index in tables.around[src_index]:
+                    target = self.get_index(index)
+                    if target is not None and target.player != player:
+                        hits += 1
+                        if target.health <= SELFDESTRUCT_DAMAGE:
+                            gain += UNIT_VALUES[target.type.value]
+                if hits > 0:
+                    moves.append((gain, SELFDESTRUCT_DAMAGE*hits, CoordPair(src, src)))
+        moves.sort(key=lambda move: (move[0], move[1]), reverse=True)
+        return [(gain, move) for (gain, _, move) in moves]
+
+    def quiescence(self, alpha: float, beta: float, maximizing_player: bool, ply: int) -> float:
+        """Search only attacks and self-destructs below the depth limit, until the position is quiet.
+
+        The side to move may stand pat on the static evaluation instead. Moves that could not bring the
+        score back into the window even by killing everything they hit are skipped (delta pruning), and
+        once Options.quiescence_nodes nodes were searched in the iteration every node just stands pat.
+        """
+        player = self.next_player if maximizing_player else self.next_player.next()
+        stand_pat = self.evaluate(player)
+        search = self._search
+        if search is not None:
+            search.evaluations_per_depth[ply] = search.evaluations_per_depth.get(ply, 0) + 1
+        if self.is_finished():
+            return stand_pat if self._tablebase is None else self.finished_score(player, ply)
+        if self._qnodes >= self.options.quiescence_nodes:
+            if search is not None:
+                search.quiescence_capped += 1
+            return stand_pat
+        if maximizing_player:
+            if stand_pat >= beta:
+                return stand_pat
+            alpha = max(alpha, stand_pat)
+        else:
+            if stand_pat <= alpha:
+                return stand_pat
+            beta = min(beta, stand_pat)
+        weights = self.options.eval_weights
+        best_eval = stand_pat
+        for (gain, move) in self.tactical_moves():
+            # moves are sorted by gain, so once one cannot reach the window none of the rest can
+            bound = abs(weights.w0)*gain/weights.scale + self._delta_margin
+            if (stand_pat + bound <= alpha) if maximizing_player else (stand_pat - bound >= beta):
+                break
+            self._nodes += 1
+            self._qnodes += 1
+            if self._nodes & (DEADLINE_CHECK_INTERVAL-1) == 0 and self.search_stopped():
+                raise SearchTimeout()
+            if search is not None:
+                search.quiescence_nodes += 1
+            self.make_move(move)
+            eval = self.quiescence(alpha, beta, not maximizing_player, ply+1)
+            self.unmake_move()
+            if maximizing_player:
+                best_eval = max(best_eval, eval)
+                alpha = max(alpha, eval)
+            else:
+                best_eval = min(best_eval, eval)
+                beta = min(beta, eval)
+            if beta <= alpha:
+                break
+        return best_eval
+
+    def search_stopped(self) -> bool:
+        """Has the search deadline passed (or, for a Lazy SMP helper, has the main searcher finished)?"""
+        if self._deadline is not None and perf_counter() > self._deadline:
+            return True
+        return self._stop is not None and self._stop.is_set()
+
+    def setup_quiescence(self):
+        """Reset the quiescence node budget and work out the delta pruning margin for a new search.
+
+        The margin is a generous bound on how much e1 and e2 (not e0) can move in one exchange:
+        up to 9 health per unit for e1, and the board's diameter for e2. With a tablebase loaded, any capture
+        can end the game (or reach a solved position) at a score no material bound covers: no delta pruning.
+        """
+        self._qnodes = 0
+        if self._tablebase is not None:
+            self._delta_margin = float('inf')
+            return
+        weights = self.options.eval_weights
+        units = len(self._pieces[0]) + len(self._pieces[1])
+        self._delta_margin = (abs(weights.w1)*18*units + abs(weights.w2)*2*self.options.dim) / weights.scale
+
+    def search_copy(self) -> Game:
+        """Copy of the game to send to a worker process (without the search tables, with fresh stats)."""
+        new = self.clone()
+        new.stats = Stats()
+        new._nodes = 0
+        new._tt = None
+        new._orderer = None
+        new._book = None
+        new._broker = None
+        new._deadline = None
+        new._pool = None
+        new._pool_alpha = None
+        new._pool_stop = None
+        new._stop = None
+        if self._search is not None:
+            new._search = SearchStats()
+        return new
+
+    def root_pool(self) -> ProcessPoolExecutor:
+        """Process pool of the parallel searches (started on first use).
+
+        With lazy_smp the pool runs workers-1 helpers and the transposition table is moved to shared memory.
+        """
+        if self._pool is None:
+            options = self.options
+            tt_name = None
+            if options.lazy_smp:
+                self._tt = SharedTranspositionTable(options.tt_size_mb)
+                tt_name = self._tt.shm.name
+            self._pool_alpha = multiprocessing.Value('d', MIN_HEURISTIC_SCORE)
+            self._pool_stop = multiprocessing.Event()
+            self._pool = ProcessPoolExecutor(max_workers=options.workers-1 if options.lazy_smp else options.workers,
+                initializer=init_search_worker, initargs=(self._pool_alpha, self._pool_stop, options.tt_size_mb, tt_name))
+        return self._pool
+
+    def close(self):
+        """Stop pondering, shut down the worker processes of the parallel searches and free the shared table, if any."""
+        self.finish_ponder(False)
+        if self._broker is not None:
+            self._broker.close()
+            self._broker = None
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+            self._pool_alpha = None
+            self._pool_stop = None
+        if isinstance(self._tt, SharedTranspositionTable):
+            self._tt.close(unlink=True)
+            self._tt = None
+        if self._book is not None:
+            self._book.close()
+            self._book = None
+        if self._tablebase is not None:
+            self._tablebase.close()
+            self._tablebase = None
+
+    def start_helpers(self, min_depth: int, max_depth: int) -> list:
+        """Start the Lazy SMP helpers on the root position; they run until the main searcher sets the stop event."""
+        pool = self.root_pool()
+        self._pool_stop.clear()
+        snapshot = self.search_copy()
+        return [pool.submit(smp_helper_search, snapshot, helper, min_depth, max_depth) for helper in range(1, self.options.workers)]
+
+    def search_root_parallel(self, depth: int) -> Tuple[int, CoordPair | None, float]:
+        """Search each root move in its own worker process task (root splitting).
+
+        The workers share the best score found so far as their alpha bound. The best exact
+        score wins, ties going to the move that was ordered first, so the result does not
+        depend on which worker finishes first.
+        """
+        moves = list(self.move_candidates())
+        if depth <= 1 or len(moves) <= 1 or self.is_finished():
+            return self.minimax(depth, MIN_HEURISTIC_SCORE, MAX_HEURISTIC_SCORE, True)
+        if self._orderer is not None:
+            moves = self._orderer.order(self, moves, 0, self._orderer.root_move)
+        pool = self.root_pool()
+        with self._pool_alpha.get_lock():
+            self._pool_alpha.value = MIN_HEURISTIC_SCORE
+        snapshot = self.search_copy()
+        # wall clock deadline, since perf_counter values are not comparable between processes
+        deadline = None if self._deadline is None else time() + (self._deadline - perf_counter())
+        futures = [pool.submit(search_root_move, snapshot, i, move, depth, deadline) for (i, move) in enumerate(moves)]
+        best_index = -1
+        best_eval = MIN_HEURISTIC_SCORE
+        timed_out = False
+        for future in futures:
+            (index, eval, alpha, nodes, search) = future.result()
+            self._nodes += nodes
+            if self._search is not None and search is not None:
+                self._search.merge(search)
+            if eval is None:
+                timed_out = True
+            elif eval > alpha and (best_index < 0 or eval > best_eval):
+                # results at or below the alpha they were searched with are only upper bounds
+                best_index = index
+                best_eval = eval
+        if timed_out:
+            raise SearchTimeout()
+        best_move = moves[max(best_index, 0)]
+        if self._tt is not None:
+            dim = self.options.dim
+            tt_key = self.tt_key(self.next_player)
+            self._tt.store(tt_key, depth, TT_EXACT, best_eval,
+                best_move.src.row*dim+best_move.src.col, best_move.dst.row*dim+best_move.dst.col)
+        return (best_eval, best_move, depth)
+
+    def aspiration_search(self, depth: int, previous: float) -> Tuple[int, CoordPair | None, float]:
+        """Search the root in a window around the previous iteration's score, widening the side that fails."""
+        width = self.options.aspiration_window
+        (alpha, beta) = (previous - width, previous + width)
+        (low_width, high_width) = (width, width)
+        while True:
+            result = self.minimax(depth, alpha, beta, True)
+            score = result[0]
+            if score <= alpha and alpha > MIN_HEURISTIC_SCORE:
+                low_width *= 4
+                alpha = score - low_width if low_width < width*ASPIRATION_MAX_WIDENING else MIN_HEURISTIC_SCORE
+            elif score >= beta and beta < MAX_HEURISTIC_SCORE:
+                high_width *= 4
+                beta = score + high_width if high_width < width*ASPIRATION_MAX_WIDENING else MAX_HEURISTIC_SCORE
+            else:
+                return result
+            if self._search is not None:
+                self._search.aspiration_researches += 1
+
+    def iterative_deepening(self) -> Tuple[int, CoordPair | None, float]:
+        """Search depth min_depth, min_depth+1, ... up to max_depth until max_time runs out.
+
+        Returns the result of the deepest completed iteration.
+        """
+        min_depth = self.options.min_depth if self.options.min_depth is not None else 1
+        max_depth = self.options.max_depth if self.options.max_depth is not None else MAX_SEARCH_DEPTH
+        if self.options.max_time is not None:
+            # keep a little of the budget for returning and playing the move
+            self._deadline = perf_counter() + self.options.max_time * 0.95
+        self._nodes = 0
+        self._root_turns = self.turns_played
+        self._null_ply = -2
+        if self.options.tablebase is not None and self._tablebase is None:
+            self._tablebase = Tablebase(self.options.tablebase, self.options.dim)
+        self.setup_quiescence()
+        search = None
+        if self.options.collect_stats:
+            search = SearchStats(turn=self.turns_played, player=self.next_player.name)
+        self._search = search
+        if self.options.move_ordering:
+            if self._orderer is None:
+                self._orderer = MoveOrderer(self.options.dim)
+            self._orderer.new_search()
+        result = (0, None, 0)
+        lazy_smp = self.options.lazy_smp and self.options.workers > 1 and self.options.tt_size_mb > 0
+        helpers = self.start_helpers(max(1, min_depth), max_depth) if lazy_smp else []
+        try:
+            for depth in range(max(1, min_depth), max_depth+1):
+                if search is not None:
+                    (iteration_start, iteration_nodes) = (perf_counter(), self._nodes)
+                # every iteration gets the whole quiescence budget (the deepest one chooses the move)
+                self._qnodes = 0
+                if self.options.workers > 1 and not lazy_smp:
+                    result = self.search_root_parallel(depth)
+                elif result[1] is not None and self.options.aspiration_window > 0:
+                    result = self.aspiration_search(depth, result[0])
+                else:
+                    result = self.minimax(depth, MIN_HEURISTIC_SCORE, MAX_HEURISTIC_SCORE, True)
+                if search is not None:
+                    search.iteration_nodes.append(self._nodes - iteration_nodes)
+                    search.iteration_seconds.append(perf_counter() - iteration_start)
+                if self._orderer is not None and result[1] is not None:
+                    self._orderer.root_move = self._orderer.move_index(result[1])
+        except SearchTimeout:
+            # take back the moves of the aborted iteration
+            while self._undo_log:
+                self.unmake_move()
+        finally:
+            self._deadline = None
+            if helpers:
+                self._pool_stop.set()
+                for helper in helpers:
+                    self._nodes += helper.result()
+        if result[1] is None:
+            # not even the first iteration finished: fall back on the stored or the first legal move
+            move = None
+            if self._tt is not None:
+                entry = self._tt.probe(self.tt_key(self.next_player))
+                if entry is not None:
+                    move = self.tt_move(entry[3], entry[4])
+            if move is None:
+                move = next(iter(self.move_candidates()), None)
+            result = (result[0], move, 0)
+        return result
+
+    def book_move(self) -> Tuple[CoordPair, float, int] | None:
+        """(move, score, depth) of the position in the opening book, or None if it is out of book."""
+        if self._book is None:
+            self._book = OpeningBook(self.options.book)
+        if self._book.dim != self.options.dim:
+            return None
+        entry = self._book.probe(self._hash)
+        if entry is None:
+            return None
+        (src, dst, score, depth) = entry
+        move = self.tt_move(src, dst)
+        # the hash could collide with a position that is not in the book
+        if move is None or not self.is_valid_move(move):
+            return None
+        return (move, score, depth)
+
+    def is_computer(self, player: Player) -> bool:
+        """Is player played by the computer in this game type ?"""
+        game_type = self.options.game_type
+        return (game_type == GameType.CompVsComp
+            or (game_type == GameType.AttackerVsComp and player == Player.Defender)
+            or (game_type == GameType.CompVsDefender and player == Player.Attacker))
+
+    def start_ponder(self):
+        """Search the position after the opponent's expected reply in a thread while the opponent thinks.
+
+        The expected reply is the best move our last search stored for this position. The ponder search
+        shares the transposition table and has no time limit: finish_ponder stops it or gives it the time of a move.
+        """
+        if (not self.options.ponder or self._ponder is not None or self._tt is None or self.is_finished()
+                or self.is_computer(self.next_player) or not self.is_computer(self.next_player.next())):
+            return
+        entry = self._tt.probe(self.tt_key(self.next_player.next()))
+        move = None if entry is None else self.tt_move(entry[3], entry[4])
+        if move is None or not self.is_valid_move(move):
+            return
+        ponder = self.clone()
+        ponder.perform_move(move)
+        ponder.next_turn()
+        if ponder.is_finished():
+            return
+        # a serial search: the worker processes are for the real searches
+        ponder.options = replace(self.options, max_time=None, workers=1)
+        ponder._stop = threading.Event()
+        ponder._ponder_result = None
+        ponder._root_turns = ponder.turns_played
+        self._ponder = ponder
+        self._ponder_root = (ponder._hash, perf_counter())
+        self._ponder_thread = threading.Thread(target=ponder.ponder_search, daemon=True)
+        self._ponder_thread.start()
+
+    def ponder_search(self):
+        """Body of the ponder thread."""
+        self._ponder_result = self.iterative_deepening()
+
+    def finish_ponder(self, use: bool) -> Game | None:
+        """End the ponder search, if any.
+
+        On a ponder hit (the opponent played the expected reply) and if use, the search goes on until the
+        time of a move since it started has passed, and its game is returned. Otherwise it is stopped and its result thrown away, what it
+        stored in the transposition table being kept.
+        """
+        ponder = self._ponder
+        if ponder is None:
+            return None
+        thread = self._ponder_thread
+        (self._ponder, self._ponder_thread) = (None, None)
+        # (the ponder game itself is somewhere in its search tree)
+        hit = use and self._ponder_root[0] == self._hash and ponder._root_turns == self.turns_played
+        if not hit:
+            ponder._stop.set()
+        elif self.options.max_time is not None:
+            # the time spent pondering counts as time of the move
+            ponder._deadline = self._ponder_root[1] + self.options.max_time * 0.95
+        thread.join()
+        if not hit or ponder._ponder_result is None or ponder._ponder_result[1] is None:
+            return None
+        return ponder
 
-        
     def suggest_move(self) -> CoordPair | None:
-        """Suggest the next move using minimax alpha beta."""
+        """Suggest the next move from the opening book, the ponder search or else using minimax alpha beta."""
         start_time = datetime.now()
-        (score, move, avg_depth) = self.minimax(3, MIN_HEURISTIC_SCORE, MAX_HEURISTIC_SCORE, True)
+        book = self.book_move() if self.options.book is not None else None
+        ponder = self.finish_ponder(book is None)
+        if book is not None:
+            (move, score, depth) = book
+            elapsed_seconds = (datetime.now() - start_time).total_seconds()
+            self.stats.total_seconds += elapsed_seconds
+            self.stats.last_score = score
+            self.stats.last_depth = depth
+            if self.options.collect_stats:
+                self.stats.add_search(SearchStats(turn=self.turns_played, player=self.next_player.name,
+                    move=move.to_string(), score=score, depth=depth, seconds=elapsed_seconds, book=True))
+            if self.options.verbose:
+                print(f"Book move: score {score}, depth {depth} ({elapsed_seconds*1000000:0.0f}us)")
+            return move
+        if ponder is not None:
+            (score, move, depth) = ponder._ponder_result
+            self._nodes = ponder._nodes
+            self._search = ponder._search
+            if self._search is not None:
+                self._search.ponder = True
+        else:
+            if self._tt is None and self.options.tt_size_mb > 0:
+                self._tt = TranspositionTable(self.options.tt_size_mb)
+            (score, move, depth) = self.iterative_deepening()
         elapsed_seconds = (datetime.now() - start_time).total_seconds()
         self.stats.total_seconds += elapsed_seconds
+        self.stats.nodes += self._nodes
+        self.stats.last_score = score
+        self.stats.last_depth = depth
+        search = self._search
+        if search is not None:
+            (search.move, search.score, search.depth, search.seconds) = (None if move is None else move.to_string(), score, depth, elapsed_seconds)
+            self.stats.add_search(search)
+            self._search = None
+        if not self.options.verbose:
+            return move
         print(f"Heuristic score: {score}")
+        print(f"Search depth: {depth}")
+        if search is not None:
+            print(f"Branching factor: {search.branching_factor():0.2f}, TT hits: {search.tt_hits}/{search.tt_probes}")
+            if search.quiescence_capped > 0:
+                print(f"Quiescence budget spent: {search.quiescence_capped} nodes stood pat")
+        if self.stats.cutoffs > 0:
+            print(f"First move cutoffs: {100*self.stats.first_move_cutoffs/self.stats.cutoffs:0.1f}% of {self.stats.cutoffs}")
         print(f"Evals per depth: ",end='')
         for k in sorted(self.stats.evaluations_per_depth.keys()):
             print(f"{k}:{self.stats.evaluations_per_depth[k]} ",end='')
@@ -753,6 +2409,13 @@ class Game:
         print(f"Elapsed time: {elapsed_seconds:0.1f}s")
         return move
 
+    def broker_client(self) -> BrokerClient:
+        """Client of the game broker (connected on first use)."""
+        if self._broker is None:
+            from broker import BrokerClient
+            self._broker = BrokerClient(self.options.broker)
+        return self._broker
+
     def post_move_to_broker(self, move: CoordPair):
         """Send a move to the game broker."""
         if self.options.broker is None:
@@ -763,44 +2426,220 @@ class Game:
             "turn": self.turns_played
         }
         try:
-            r = requests.post(self.options.broker, json=data)
-            if r.status_code == 200 and r.json()['success'] and r.json()['data'] == data:
-                # print(f"Sent move to broker: {move}")
-                pass
-            else:
-                print(f"Broker error: status code: {r.status_code}, response: {r.json()}")
+            self.broker_client().post_move(data)
         except Exception as error:
             print(f"Broker error: {error}")
 
     def get_move_from_broker(self) -> CoordPair | None:
-        """Get a move from the game broker."""
+        """Get the move of the next turn from the game broker, waiting for it with backoff."""
         if self.options.broker is None:
             return None
-        headers = {'Accept': 'application/json'}
+        data = self.broker_client().wait_for_move(self.turns_played+1)
+        if data is None:
+            return None
+        move = CoordPair(
+            Coord(data['from']['row'],data['from']['col']),
+            Coord(data['to']['row'],data['to']['col'])
+        )
+        print(f"Got move from broker: {move}")
+        return move
+
+##############################################################################################################
+
+# state of a parallel search worker process, set up by init_search_worker
+_worker_alpha = None
+_worker_stop = None
+_worker_tt : TranspositionTable | None = None
+
+def init_search_worker(alpha, stop, tt_size_mb: int, tt_name: str | None):
+    """Process pool initializer: keep the shared alpha bound and stop event, and set up the transposition table.
+
+    Lazy SMP helpers attach to the shared table named tt_name, root-parallel workers get their own.
+    """
+    global _worker_alpha, _worker_stop, _worker_tt
+    _worker_alpha = alpha
+    _worker_stop = stop
+    if tt_name is not None:
+        _worker_tt = SharedTranspositionTable(tt_size_mb, tt_name)
+    else:
+        _worker_tt = TranspositionTable(tt_size_mb) if tt_size_mb > 0 else None
+
+def search_root_move(game: Game, index: int, move: CoordPair, depth: int, deadline: float | None) -> Tuple[int, float | None, float, int, SearchStats | None]:
+    """Search one root move in a worker process.
+
+    Returns (index, score or None if the deadline passed, alpha searched with, nodes, search counters).
+    """
+    with _worker_alpha.get_lock():
+        alpha = _worker_alpha.value
+    if alpha > MIN_HEURISTIC_SCORE:
+        alpha -= ROOT_TIE_MARGIN
+    game._tt = _worker_tt
+    if game.options.move_ordering:
+        game._orderer = MoveOrderer(game.options.dim)
+    game._root_turns = game.turns_played
+    game.setup_quiescence()
+    if deadline is not None:
+        game._deadline = perf_counter() + (deadline - time())
+    try:
+        game.make_move(move)
+        eval = game.minimax(depth - 1, alpha, MAX_HEURISTIC_SCORE, False)[0]
+    except SearchTimeout:
+        return (index, None, alpha, game._nodes, game._search)
+    if eval > alpha:
+        # tighten the bound for the root moves still to be searched
+        with _worker_alpha.get_lock():
+            if eval > _worker_alpha.value:
+                _worker_alpha.value = eval
+    return (index, eval, alpha, game._nodes, game._search)
+
+def smp_helper_search(game: Game, helper: int, min_depth: int, max_depth: int) -> int:
+    """Iterative deepening of a Lazy SMP helper in a worker process, until the stop event is set.
+
+    Odd helpers start one iteration deeper than the main searcher so that the helpers fill the
+    shared transposition table ahead of it. Returns the number of nodes searched.
+    """
+    game._tt = _worker_tt
+    game._stop = _worker_stop
+    if game.options.move_ordering:
+        game._orderer = MoveOrderer(game.options.dim)
+    game._root_turns = game.turns_played
+    game.setup_quiescence()
+    try:
+        for depth in range(min(min_depth + helper % 2, max_depth), max_depth+1):
+            game._qnodes = 0
+            move = game.minimax(depth, MIN_HEURISTIC_SCORE, MAX_HEURISTIC_SCORE, True)[1]
+            if game._orderer is not None and move is not None:
+                game._orderer.root_move = game._orderer.move_index(move)
+    except SearchTimeout:
+        pass
+    return game._nodes
+
+##############################################################################################################
+
+def render_board(position: str) -> str:
+    """Board text of the board part of a to_position_string text, as board_config_to_string writes it."""
+    rows = position.split('/')
+    coord = Coord()
+    output = "\n   "
+    for col in range(len(rows)):
+        coord.col = col
+        output += f"{coord.col_string():^3} "
+    output += "\n"
+    for (row, cells) in enumerate(rows):
+        coord.row = row
+        output += f"{coord.row_string()}: "
+        for cell in cells.split(','):
+            output += " .  " if cell == "." else f"{cell:^3} "
+        output += "\n"
+    return output
+
+def render_trace_record(record: dict) -> str:
+    """Human readable text of a game trace record."""
+    kind = record['type']
+    if kind == 'start':
+        return (f"\n --- GAME PARAMETERS --- \n\nt = {record['max_time']}s\nmax # of turns: {record['max_turns']}\n"
+            f"game type: {record['game_type']}\nalpha-beta: {record['alpha_beta']}\n\n"
+            f"\n --- INITIAL BOARD CONFIG ---\n{render_board(record['position'].split()[0])}\n\n --- TURNS ---\n\n")
+    if kind == 'turn':
+        (src, dst) = record['move'].split()
+        action = {'move': f"move from {src} to {dst}", 'selfdestruct': f"player at {src} did a self-destruct",
+            'repair': f"player at {src} repaired teammate at {dst}"}.get(record['action'], f"player at {src} attacked opponent at {dst}")
+        output = f"turn #{record['turn']}\nplayer: {record['player']} ({record['by']})\naction: {action}\n"
+        if record['health']:
+            output += "health: " + ", ".join(f"{cell} {delta:+d}" for (cell, delta) in record['health'].items()) + "\n"
+        search = record.get('search')
+        if search is not None:
+            output += f"search: score {search['score']:0.1f}, depth {search['depth']}, {search['seconds']:0.2f}s"
+            if 'nodes' in search:
+                output += f", {search['nodes']} nodes"
+            output += "\n"
+        return output + render_board(record['position'].split()[0]) + "\n"
+    turns = record['turns']
+    if record['winner'] is None:
+        return f"\n --- NO WINNER --- \n\ngame stopped after {turns} turn{'' if turns == 1 else 's'}: {record['reason']}\n"
+    return f"\n --- WINNER --- \n\n{record['winner']} wins in {turns} turn{'' if turns == 1 else 's'}!\n"
+
+class TraceWriter:
+    """Game trace written by a background thread, so that file writes never hold up the game loop.
+
+    The game loop queues one record per turn (bounded queue: it only waits if the writer falls that far
+    behind) and the thread writes them as compact JSON lines, and optionally as human readable text.
+    """
+
+    def __init__(self, path: str, text_path: str | None = None, queue_size: int = TRACE_QUEUE_SIZE):
+        self.file = open(path, 'w')
+        self.text_file = open(text_path, 'w') if text_path is not None else None
+        self.queue : queue.Queue[dict | None] = queue.Queue(maxsize=queue_size)
+        self.records = 0
+        self.thread = threading.Thread(target=self.run, name="trace writer", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """Write queued records until the end marker (None), then close the files."""
         try:
-            r = requests.get(self.options.broker, headers=headers)
-            if r.status_code == 200 and r.json()['success']:
-                data = r.json()['data']
-                if data is not None:
-                    if data['turn'] == self.turns_played+1:
-                        move = CoordPair(
-                            Coord(data['from']['row'],data['from']['col']),
-                            Coord(data['to']['row'],data['to']['col'])
-                        )
-                        print(f"Got move from broker: {move}")
-                        return move
-                    else:
-                        # print("Got broker data for wrong turn.")
-                        # print(f"Wanted {self.turns_played+1}, got {data['turn']}")
-                        pass
-                else:
-                    # print("Got no data from broker")
-                    pass
-            else:
-                print(f"Broker error: status code: {r.status_code}, response: {r.json()}")
-        except Exception as error:
-            print(f"Broker error: {error}")
-        return None
+            while True:
+                record = self.queue.get()
+                if record is None:
+                    break
+                self.file.write(json.dumps(record, separators=(',', ':')) + "\n")
+                if self.text_file is not None:
+                    self.text_file.write(render_trace_record(record))
+                self.records += 1
+        finally:
+            self.file.close()
+            if self.text_file is not None:
+                self.text_file.close()
+
+    def write(self, record: dict):
+        """Queue a record."""
+        self.queue.put(record)
+
+    def start(self, game: Game):
+        """Queue the record of the game options and initial board."""
+        options = game.options
+        self.write({'type': 'start', 'game_type': options.game_type.name, 'max_time': options.max_time,
+            'max_depth': options.max_depth, 'max_turns': options.max_turns, 'alpha_beta': options.alpha_beta,
+            'position': game.to_position_string(), 'time': datetime.now().isoformat(timespec='seconds')})
+
+    def turn(self, game: Game, player: Player, by: str, healths: dict[int, int]):
+        """Queue the record of the turn just played, given the unit healths before it.
+
+        Health deltas are by cell (a killed unit loses the health it had); computer turns add their search.
+        """
+        (move, action) = game._last_move
+        coords = NeighbourTables.for_dim(game.options.dim).coords
+        deltas = {}
+        if action != 'move':
+            after = game.unit_healths()
+            for (index, health) in healths.items():
+                if after.get(index, 0) != health:
+                    deltas[coords[index].to_string()] = after.get(index, 0) - health
+        record = {'type': 'turn', 'turn': game.turns_played, 'player': player.name, 'by': by,
+            'move': move.to_string(), 'action': action, 'health': deltas,
+            'position': game.to_position_string()}
+        if by == 'computer':
+            stats = game.stats
+            search = {'score': stats.last_score, 'depth': stats.last_depth, 'seconds': 0.0}
+            if stats.moves and stats.moves[-1].turn == game.turns_played - 1:
+                last = stats.moves[-1]
+                search = {'score': last.score, 'depth': last.depth, 'seconds': last.seconds,
+                    'nodes': sum(last.nodes_per_depth.values()), 'tt_hits': last.tt_hits, 'cutoffs': last.cutoffs,
+                    'book': last.book, 'ponder': last.ponder}
+            record['search'] = search
+        self.write(record)
+
+    def finish(self, game: Game, winner: Player | None, reason: str | None = None):
+        """Queue the record of the end of the game (without a winner if it was cut short, for a reason)."""
+        record = {'type': 'end', 'winner': None if winner is None else winner.name, 'turns': game.turns_played}
+        if reason is not None:
+            record['reason'] = reason
+        self.write(record)
+
+    def close(self):
+        """Write the records still queued, close the files and stop the thread (more calls do nothing)."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
 
 ##############################################################################################################
 
@@ -815,6 +2654,26 @@ def main():
     parser.add_argument('--max_turns', type=int, help='maximum turns')
     parser.add_argument('--game_type', type=str, default="manual", help='game type: auto|attacker|defender|manual')
     parser.add_argument('--broker', type=str, help='play via a game broker')
+    parser.add_argument('--compact_board', action='store_true', help='store the board in flat byte arrays')
+    parser.add_argument('--tt_size_mb', type=int, help='transposition table size in MB (0 to disable)')
+    parser.add_argument('--no_move_ordering', action='store_true', help='search moves in generation order')
+    parser.add_argument('--eval_mode', type=str, default="fused", help='leaf evaluation: classic|incremental|fused')
+    parser.add_argument('--eval_parity', action='store_true', help='check every evaluation against e0/e1/e2')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes for the root-parallel search')
+    parser.add_argument('--lazy_smp', action='store_true', help='use the workers as Lazy SMP searchers sharing the transposition table')
+    parser.add_argument('--no_stats', action='store_true', help='do not collect search statistics')
+    parser.add_argument('--no_quiescence', action='store_true', help='stop the search at the depth limit, even in the middle of combat')
+    parser.add_argument('--quiescence_nodes', type=int, help='quiescence nodes allowed per iteration of the search')
+    parser.add_argument('--no_pvs', action='store_true', help='search every move with the full alpha-beta window')
+    parser.add_argument('--null_move', action='store_true', help='use null-move pruning')
+    parser.add_argument('--lmr', action='store_true', help='reduce the depth of quiet moves ordered late')
+    parser.add_argument('--aspiration_window', type=float, help='half width of the aspiration window around the last score (0 to disable)')
+    parser.add_argument('--book', type=str, help='opening book file (see book.py)')
+    parser.add_argument('--tablebase', type=str, help='directory of endgame tablebase files (see tablebase.py)')
+    parser.add_argument('--ponder', action='store_true', help='search on the opponent\'s time')
+    parser.add_argument('--stats_file', type=str, help='write the search statistics of the game to a JSON file')
+    parser.add_argument('--trace', type=str, help='JSON lines game trace file (default: gameTrace-<alpha_beta>-<max_time>-<max_turns>.jsonl)')
+    parser.add_argument('--no_trace_text', action='store_true', help='do not also write the game trace as text (gameTrace-...txt)')
     args = parser.parse_args()
 
     # parse the game type
@@ -840,62 +2699,80 @@ def main():
         options.max_turns = args.max_turns
     if args.broker is not None:
         options.broker = args.broker
+    options.compact_board = args.compact_board
+    if args.tt_size_mb is not None:
+        options.tt_size_mb = args.tt_size_mb
+    options.move_ordering = not args.no_move_ordering
+    if args.eval_mode == "incremental":
+        options.eval_mode = EvalMode.Incremental
+    elif args.eval_mode == "classic":
+        options.eval_mode = EvalMode.Classic
+    options.eval_parity = args.eval_parity
+    options.workers = args.workers
+    options.lazy_smp = args.lazy_smp
+    options.collect_stats = not args.no_stats
+    options.quiescence = not args.no_quiescence
+    if args.quiescence_nodes is not None:
+        options.quiescence_nodes = args.quiescence_nodes
+    options.pvs = not args.no_pvs
+    options.null_move = args.null_move
+    options.lmr = args.lmr
+    if args.aspiration_window is not None:
+        options.aspiration_window = args.aspiration_window
+    if args.book is not None:
+        try:
+            OpeningBook.check(args.book)
+        except (OSError, ValueError) as error:
+            parser.error(f"--book: {error}")
+        options.book = args.book
+    if args.tablebase is not None:
+        options.tablebase = args.tablebase
+    options.ponder = args.ponder
 
     # create a new game
     game = Game(options=options)
 
 
-    # make a file to write output to
-    filename = 'gameTrace-' + str(game.options.alpha_beta) + '-' + str(int(game.options.max_time)) + '-' + str(game.options.max_turns) + '.txt'
-    out_file = open(filename, 'w')
+    # write the game trace in the background: JSON lines, and the human readable text unless disabled
+    max_time = 'none' if game.options.max_time is None else str(int(game.options.max_time))
+    filename = 'gameTrace-' + str(game.options.alpha_beta) + '-' + max_time + '-' + str(game.options.max_turns)
+    trace = TraceWriter(args.trace or filename + '.jsonl', None if args.no_trace_text else filename + '.txt')
+    trace.start(game)
 
-    # start writing relevant info to output file
-    out_file.write("\n --- GAME PARAMETERS --- \n\n")
-    out_file.write("t = " + str(game.options.max_time) + "s\n")
-    out_file.write("max # of turns: " + str(game.options.max_turns) + "\n\n")
-    out_file.write("\n --- INITIAL BOARD CONFIG ---\n")
-    out_file.write(game.board_config_to_string())
-    out_file.write('\n\n --- TURNS ---\n\n')
-
-    # the main game loop
-    while True:
-        print()
-        print(game)
-        winner = game.has_winner()
-        if winner is not None:
-            print(f"{winner.name} wins!")
-            # print it to the output file too
-            out_file.write('\n --- WINNER --- \n\n')
-            out_file.write(winner.name + ' wins in ' + str(game.turns_played))
-            if game.turns_played == 1:
-                out_file.write(' turn!\n')
-            else:
-                out_file.write(' turns!\n')
-            break
-        if game.options.game_type == GameType.AttackerVsDefender:
-            result = game.human_turn()
-            out_file.write('turn #' + str(game.turns_played) + '\n')
-            if game.next_player == Player.Attacker:
-                player = 'Defender'
-            else:   
-                player = 'Attacker'
-            out_file.write('player: ' + player + '\n')
-            out_file.write('action: ' + result)
-            out_file.write(game.board_config_to_string() + '\n')
-            # ADD STUFF HERE
-        elif game.options.game_type == GameType.AttackerVsComp and game.next_player == Player.Attacker:
-            game.human_turn()
-        elif game.options.game_type == GameType.CompVsDefender and game.next_player == Player.Defender:
-            game.human_turn()
-        else:
+    # the main game loop (the trace is written out and the game's workers and tables released however it ends)
+    try:
+        while True:
+            print()
+            print(game)
+            winner = game.has_winner()
+            if winner is not None:
+                print(f"{winner.name} wins!")
+                trace.finish(game, winner)
+                break
             player = game.next_player
-            move = game.computer_turn()
-            if move is not None:
-                game.post_move_to_broker(move)
+            healths = game.unit_healths()
+            if (game.options.game_type == GameType.AttackerVsDefender
+                    or (game.options.game_type == GameType.AttackerVsComp and player == Player.Attacker)
+                    or (game.options.game_type == GameType.CompVsDefender and player == Player.Defender)):
+                game.human_turn()
+                trace.turn(game, player, 'human' if game.options.broker is None else 'broker', healths)
             else:
-                print("Computer doesn't know what to do!!!")
-                out_file.close()
-                exit(1)
+                move = game.computer_turn()
+                if move is not None:
+                    trace.turn(game, player, 'computer', healths)
+                    game.post_move_to_broker(move)
+                else:
+                    print("Computer doesn't know what to do!!!")
+                    trace.finish(game, None, f"no move for {player.name}")
+                    exit(1)
+        if game._broker is not None:
+            print(f"Broker: {game._broker.metrics.summary()}")
+        if args.stats_file is not None:
+            with open(args.stats_file, 'w') as stats_file:
+                stats_file.write(game.stats.to_json())
+    finally:
+        trace.close()
+        game.close()
 
 ##############################################################################################################
 